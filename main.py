@@ -1,10 +1,22 @@
+import sys
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from fastapi import Query
-from xiyou.compare_service import CompareChapterQuery, CompareBatchQuery, compare_chapter, compare_overview, compare_batch, CompareBatchBooksQuery, compare_overview_multi, compare_batch_books
-from xiyou.config import load_settings, list_target_books
+from xiyou.compare_service import CompareChapterQuery, CompareBatchQuery, compare_chapter, compare_overview, compare_batch, compare_batch_stream, CompareBatchBooksQuery, compare_overview_multi, compare_batch_books
+from xiyou.config import load_settings, list_target_books, reload_settings
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # 若本进程用过提取侧的共享 LLM 客户端，退出时关闭其连接池
+    mod = sys.modules.get("xiyou.batch_extractor")
+    if mod is not None:
+        await mod.close_async_client()
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/")
@@ -27,6 +39,8 @@ def api_compare_overview(book: str):
 
 @app.post("/compare/batch")
 def api_compare_batch(payload: CompareBatchQuery):
+    if payload.stream:
+        return StreamingResponse(compare_batch_stream(payload), media_type="application/x-ndjson")
     return compare_batch(payload)
 
 @app.get("/compare/overview_multi")
@@ -39,3 +53,8 @@ def api_compare_overview_multi(books: List[str] = Query(default=[])):
 @app.post("/compare/batch_books")
 def api_compare_batch_books(payload: CompareBatchBooksQuery):
     return compare_batch_books(payload)
+
+@app.post("/admin/reload")
+def api_admin_reload():
+    reload_settings()
+    return {"status": "reloaded"}
@@ -4,13 +4,37 @@ import re
 import time
 import logging
 import uuid
-from openai import OpenAI
+import asyncio
+import functools
+import hashlib
+import math
+from openai import OpenAI, AsyncOpenAI
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import httpx
+except ImportError:
+    httpx = None
+# httpx 的 HTTP/2 支持需要可选的 h2 包，缺了时 http2=True 会直接抛错
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
 try:
     from xiyou.config import load_settings, resolve_paths, list_target_books
+    from xiyou import result_store
 except ImportError:
     import sys
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
     from xiyou.config import load_settings
+    from xiyou import result_store
 
 settings = load_settings()
 logging.basicConfig(level=logging.INFO, format="%(message)s")
@@ -33,16 +57,115 @@ if not API_KEY or not BASE_URL:
     raise ValueError("缺少LLM配置")
 os.makedirs(RESULT_DIR, exist_ok=True)
 
+# 响应缓存：章节文本不可变，(文本, 模板, 模型) 相同则直接复用已解析结果
+_PROMPT_VERSION = "v2"  # _build_prompt 变更时递增，使旧缓存失效
+_CACHE_TTL_S = 30 * 86400
+_RESPONSE_CACHE = diskcache.Cache(os.path.join(RESULT_DIR, ".cache")) if diskcache else None
+
 
 # ================= 核心逻辑 =================
 
+def _cache_key(text: str, template_id: str) -> str:
+    return hashlib.sha256(f"{MODEL_NAME}|{template_id}|{_PROMPT_VERSION}|{text}".encode("utf-8")).hexdigest()
+
+
+# ================= 语义缓存 =================
+# 章节草稿跨修订常只差标点/空白；精确缓存未命中时按嵌入余弦相似度
+# 复用近似重复文本的结果。阈值 run.semantic_cache_threshold，0 关闭。
+
+# 放在 .cache 子目录下：结果目录里的 *.json 会被入库/比较侧当章节结果扫描
+_SEMCACHE_PATH = os.path.join(RESULT_DIR, ".cache", "semcache.json")
+_SEM_LOCK = asyncio.Lock()
+_sem_items = None
+
+def _load_sem_items():
+    global _sem_items
+    if _sem_items is None:
+        try:
+            with open(_SEMCACHE_PATH, "r", encoding="utf-8") as f:
+                _sem_items = json.load(f).get("items", [])
+        except Exception:
+            _sem_items = []
+    return _sem_items
+
+def _save_sem_items():
+    os.makedirs(os.path.dirname(_SEMCACHE_PATH), exist_ok=True)
+    with open(_SEMCACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump({"items": _sem_items or []}, f, ensure_ascii=False)
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(x * x for x in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+async def _aembed(client, text: str):
+    model = settings["llm"].get("embedding_model", "text-embedding-v3")
+    resp = await client.embeddings.create(model=model, input=text[:4096])
+    return resp.data[0].embedding
+
+async def _semantic_lookup(client, text: str, book_key: str, template_id: str, threshold: float):
+    """返回 (embedding, 命中结果或 None)；嵌入失败时不阻断主流程
+
+    只在同书同模板的条目里找近邻：缓存目录全局共享，不同书的相似
+    章节（如开场诗、回末套语）跨书命中会把别本的抽取结果写进本书。
+    """
+    try:
+        vec = await _aembed(client, text)
+    except Exception as e:
+        logging.error(json.dumps({"stage": "extract", "event": "semcache_embed_error", "error_type": type(e).__name__, "error_message": str(e)}, ensure_ascii=False))
+        return None, None
+    async with _SEM_LOCK:
+        best = None
+        best_sim = 0.0
+        for item in _load_sem_items():
+            if item.get("book_key") != book_key or item.get("template_id") != template_id:
+                continue
+            sim = _cosine(vec, item.get("vector", []))
+            if sim > best_sim:
+                best_sim = sim
+                best = item
+        if best is not None and best_sim >= threshold:
+            logging.info(json.dumps({"stage": "extract", "event": "semcache_hit", "book_key": book_key, "template_id": template_id, "similarity": round(best_sim, 4)}, ensure_ascii=False))
+            return vec, best.get("result")
+    return vec, None
+
+async def _semantic_store(vec, book_key: str, template_id: str, result):
+    async with _SEM_LOCK:
+        _load_sem_items().append({"book_key": book_key, "template_id": template_id, "vector": vec, "result": result})
+        _save_sem_items()
+
 def get_client():
     return OpenAI(api_key=API_KEY, base_url=BASE_URL)
 
+# 进程级共享的异步客户端：复用连接池/TLS 会话，避免每次调用重建 httpx.Client
+_ASYNC_CLIENT = None
+
+def get_async_client():
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        if httpx is not None:
+            http_client = httpx.AsyncClient(http2=_HTTP2, limits=httpx.Limits(max_connections=128, max_keepalive_connections=64), timeout=TIMEOUT_MS / 1000.0)
+            _ASYNC_CLIENT = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, http_client=http_client)
+        else:
+            _ASYNC_CLIENT = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL)
+    return _ASYNC_CLIENT
+
+async def close_async_client():
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.close()
+        _ASYNC_CLIENT = None
+
+# 对白行/非空行各用一次全文扫描统计，避免逐行进出正则引擎
+_DIALOGUE_LINE_RE = re.compile(r'(?m)^[^\n]*[“”"\'][^\n]*$')
+# [^\S\n] 覆盖全角空格（U+3000）等任意非换行空白，原文缩进多用全角空格
+_NONEMPTY_LINE_RE = re.compile(r'(?m)^[^\S\n]*\S')
+
 def _estimate_dialogue_ratio(text: str) -> float:
-    lines = [l for l in text.splitlines() if l.strip()]
-    dialogue = sum(1 for l in lines if re.search(r'[“”"\']', l))
-    return dialogue / max(1, len(lines))
+    dialogue = sum(1 for _ in _DIALOGUE_LINE_RE.finditer(text))
+    lines = sum(1 for _ in _NONEMPTY_LINE_RE.finditer(text))
+    return dialogue / max(1, lines)
 
 def _choose_template(text: str) -> dict:
     selected_id = PROMPTS_CFG.get("selected", "relations_plus")
@@ -59,13 +182,17 @@ def _choose_template(text: str) -> dict:
             return t
     return {"id": selected_id, "entity_types": ["Person","Location","Item","Spell","Organization"], "relation_types": ["师徒","敌对","位于","持有","使用"], "instructions": "仅输出JSON列表"}
 
-def _build_prompt(tpl: dict, text: str) -> str:
+@functools.lru_cache(maxsize=None)
+def _static_header(template_id: str, book: str) -> str:
+    """按 (模板, 语料) 生成逐字节稳定的静态前缀，供提供商前缀缓存命中"""
+    tpl = next((t for t in PROMPTS_CFG.get("templates", []) if t.get("id") == template_id), None)
+    if tpl is None:
+        tpl = {"id": template_id, "entity_types": ["Person","Location","Item","Spell","Organization"], "relation_types": ["师徒","敌对","位于","持有","使用"], "instructions": "仅输出JSON列表"}
     entity_types = ", ".join(tpl.get("entity_types", []))
     relation_types = ", ".join(tpl.get("relation_types", []))
     instructions = tpl.get("instructions", "仅输出JSON")
     vars = tpl.get("variables", {})
     lang = vars.get("language", "zh")
-    book = vars.get("book", "")
     syn = vars.get("synonyms_map", {})
     alias_rules = vars.get("alias_rules", [])
     syn_lines = "; ".join([f"{k}->{v}" for k, v in syn.items()])
@@ -75,7 +202,7 @@ def _build_prompt(tpl: dict, text: str) -> str:
     rel_cfg = settings.get("relations", {})
     allowed = ", ".join(rel_cfg.get("allowed", []))
     precedence = ", ".join(rel_cfg.get("precedence", []))
-    header = (
+    return (
         f"你是一个知识图谱提取专家。请用{lang}输出严格的JSON。\n"
         f"语料：{book}\n"
         f"输出结构：{schema}\n"
@@ -90,20 +217,65 @@ def _build_prompt(tpl: dict, text: str) -> str:
         f"当一条证据同时支持多个关系时，请分别输出多条记录，不进行覆盖。\n"
         f"仅从闭集关系中选择，若不确定请忽略。\n"
         f"保留 evidence 原文片段，并标注触发词类别（如：姓氏/法名/封号/别名）。\n"
-        f"若实体类型无法确定，仍输出关系但勿猜测类型。\n\n"
+        f"若实体类型无法确定，仍输出关系但勿猜测类型。"
     )
-    return header + f"【文本内容】：\n{text}"
 
-def extract_chapter(client, text, filename, tpl: dict):
+def _build_prompt(tpl: dict, text: str) -> list:
+    """组装消息列表：静态前缀与章节文本分段，章节文本只出现在最后一段。
+
+    OpenAI 兼容端点（DashScope 等）对稳定前缀自动做上下文缓存，
+    消息里不能带私有字段，分段本身就足够吃到前缀缓存。
+    """
+    vars = tpl.get("variables", {})
+    header = _static_header(tpl.get("id", "relations_plus"), vars.get("book", ""))
+    return [
+        {"role": "system", "content": vars.get("system_prompt", SYSTEM_PROMPT)},
+        {"role": "user", "content": header},
+        {"role": "user", "content": f"【文本内容】：\n{text}"}
+    ]
+
+def _bracket_starts(s: str):
+    """单遍扫描，依次产出每个 { / [ 的下标作为候选起点"""
+    for i, ch in enumerate(s):
+        if ch == "{" or ch == "[":
+            yield i
+
+def _parse_llm_content(content: str):
+    content = content.replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(content)
+    except Exception:
+        # 输出前后可能夹杂说明文字：从每个括号起点尝试 raw_decode，
+        # 由解码器自己找到结构的真实结尾，避免 rfind 截错嵌套括号
+        dec = json.JSONDecoder()
+        for start in _bracket_starts(content):
+            try:
+                obj, _ = dec.raw_decode(content, start)
+                return obj
+            except json.JSONDecodeError:
+                continue
+        raise
+
+async def aextract_chapter(client, text, filename, tpl: dict):
     try:
-        prompt = _build_prompt(tpl, text)
-        messages=[
-            {"role": "system", "content": tpl.get("variables", {}).get("system_prompt", SYSTEM_PROMPT)},
-            {"role": "user", "content": prompt}
-        ]
+        key = _cache_key(text, tpl.get("id", "relations_plus"))
+        if _RESPONSE_CACHE is not None:
+            hit = _RESPONSE_CACHE.get(f"xr:{key}")
+            if hit is not None:
+                logging.info(json.dumps({"stage": "extract", "event": "cache_hit", "file": filename, "template_id": tpl.get("id", "relations_plus")}, ensure_ascii=False))
+                return json.loads(hit)
+        sem_threshold = settings["run"].get("semantic_cache_threshold", 0.0)
+        sem_vec = None
+        # _prepare_chapter 已把书键写进模板变量，语义缓存按书隔离
+        book_key = tpl.get("variables", {}).get("book") or ""
+        if sem_threshold:
+            sem_vec, sem_hit = await _semantic_lookup(client, text, book_key, tpl.get("id", "relations_plus"), sem_threshold)
+            if sem_hit is not None:
+                return sem_hit
+        messages = _build_prompt(tpl, text)
         extra = {"enable_thinking": True} if LLM_THINKING else None
         if LLM_STREAM:
-            completion = client.chat.completions.create(
+            completion = await client.chat.completions.create(
                 model=MODEL_NAME,
                 messages=messages,
                 temperature=0.1,
@@ -112,7 +284,7 @@ def extract_chapter(client, text, filename, tpl: dict):
                 extra_body=extra
             )
             chunks = []
-            for chunk in completion:
+            async for chunk in completion:
                 try:
                     delta = chunk.choices[0].delta
                     if hasattr(delta, "content") and delta.content:
@@ -121,7 +293,7 @@ def extract_chapter(client, text, filename, tpl: dict):
                     pass
             content = "".join(chunks)
         else:
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model=MODEL_NAME,
                 messages=messages,
                 temperature=0.1,
@@ -129,116 +301,217 @@ def extract_chapter(client, text, filename, tpl: dict):
                 extra_body=extra
             )
             content = response.choices[0].message.content
-        content = content.replace("```json", "").replace("```", "").strip()
-        try:
-            return json.loads(content)
-        except Exception:
-            s = content.strip()
-            i = s.find("{"); j = s.rfind("}")
-            if i != -1 and j != -1:
-                try:
-                    return json.loads(s[i:j+1])
-                except Exception:
-                    pass
-            i = s.find("["); j = s.rfind("]")
-            if i != -1 and j != -1:
-                return json.loads(s[i:j+1])
-            raise
+        result = _parse_llm_content(content)
+        if _RESPONSE_CACHE is not None and result is not None:
+            _RESPONSE_CACHE.set(f"xr:{key}", json.dumps(result, ensure_ascii=False), expire=_CACHE_TTL_S)
+        if sem_vec is not None and result is not None:
+            await _semantic_store(sem_vec, book_key, tpl.get("id", "relations_plus"), result)
+        return result
     except Exception as e:
         logging.error(json.dumps({"stage": "extract", "event": "error", "file": filename, "template_id": tpl.get("id", "relations_plus"), "error_type": type(e).__name__, "error_message": str(e)}, ensure_ascii=False))
         return None
 
 
+# 章节文件名两种命名模式共用一个模式：chapter_XXX.txt 或 XXX_标题.txt
+_CHAPTER_RE = re.compile(r"^(?:chapter_(\d{3})|(\d{3})_(.+))\.txt$")
+
 def _list_chapter_files(input_dir):
+    """枚举章节文件，返回按章节号排序的 (cid, title, path)；title 可能为 None"""
     items = []
-    for name in os.listdir(input_dir):
-        if not name.endswith(".txt"):
-            continue
-        m = re.match(r"^(?:chapter_(\d{3})|(\d{3})_.*)\.txt$", name)
-        if not m:
-            continue
-        num = int((m.group(1) or m.group(2)))
-        items.append((num, os.path.join(input_dir, name)))
+    with os.scandir(input_dir) as it:
+        for entry in it:
+            m = _CHAPTER_RE.match(entry.name)
+            if not m:
+                continue
+            num = int(m.group(1) or m.group(2))
+            items.append((num, m.group(3), entry.path))
     items.sort(key=lambda x: x[0])
-    return [p for _, p in items]
+    return items
+
+def _prepare_chapter(book_key: str, result_dir: str, i: int, total: int, cid: int, title, file_path: str):
+    """读取章节、选择模板并确定结果文件；已存在且不覆盖时返回 None"""
+    name = os.path.basename(file_path)
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if not title:
+        title = next((l for l in text.splitlines() if l.strip()), "")
+    tpl = dict(_choose_template(text))
+    tpl_vars = dict(tpl.get("variables", {}))
+    tpl_vars["book"] = book_key
+    tpl["variables"] = tpl_vars
+    template_id = tpl.get("id", "relations_plus")
+    basename_id = settings.get("results", {}).get("basename_template_id", "relations_plus")
+    result_name = f"result_{cid:03d}.json" if template_id == basename_id else f"result_{cid:03d}__tpl-{template_id}.json"
+    if settings.get("results", {}).get("use_model_suffix", False):
+        base, ext = os.path.splitext(result_name)
+        result_name = f"{base}__model-{MODEL_NAME.replace(' ', '_').replace('/', '_')}{ext}"
+    result_path = os.path.join(result_dir, result_name)
+    overwrite = settings.get("results", {}).get("overwrite", False)
+    if settings.get("results", {}).get("backend", "files") == "sqlite":
+        exists = result_store.has_result(result_dir, f"{cid:03d}", template_id, MODEL_NAME)
+    else:
+        exists = os.path.exists(result_path)
+    if exists and not overwrite:
+        logging.info(json.dumps({"stage": "extract", "event": "skip", "index": i + 1, "total": total, "file": name, "chapter_id": f"{cid:03d}", "chapter_title": title, "template_id": template_id, "model_name": MODEL_NAME}, ensure_ascii=False))
+        return None
+    if exists and overwrite:
+        logging.info(json.dumps({"stage": "extract", "event": "overwrite", "index": i + 1, "total": total, "file": name, "target": result_name, "chapter_id": f"{cid:03d}", "chapter_title": title, "template_id": template_id, "model_name": MODEL_NAME}, ensure_ascii=False))
+    return {"name": name, "cid": cid, "title": title, "text": text, "tpl": tpl, "template_id": template_id, "result_name": result_name, "result_path": result_path}
+
+def _save_payload(book_key: str, cid: int, title: str, template_id: str, data, result_path: str):
+    bk_name = None
+    items = settings.get("corpora", {}).get("items", {})
+    if isinstance(items, dict):
+        info = items.get(book_key) or {}
+        bk_name = info.get("name") or info.get("folder")
+    if not bk_name:
+        bk_name = book_key
+    meta = {"book_key": book_key, "book_name": bk_name, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "template_id": template_id, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    if isinstance(data, dict):
+        data["meta"] = meta
+        payload = data
+    else:
+        payload = {"relations": data, "meta": meta}
+    if settings.get("results", {}).get("backend", "files") == "sqlite":
+        result_store.save_result(os.path.dirname(result_path), f"{cid:03d}", template_id, MODEL_NAME, payload, meta["timestamp"])
+    elif orjson is not None:
+        with open(result_path, "wb") as f:
+            f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+    else:
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+    return payload
 
-def process_book(book_key: str, input_dir: str, result_dir: str, client):
+async def _aprocess_file(book_key: str, result_dir: str, client, i: int, total: int, cid: int, title, file_path: str):
+    prep = _prepare_chapter(book_key, result_dir, i, total, cid, title, file_path)
+    if not prep:
+        return
+    name = prep["name"]; cid = prep["cid"]; title = prep["title"]; text = prep["text"]
+    tpl = prep["tpl"]; template_id = prep["template_id"]; result_name = prep["result_name"]; result_path = prep["result_path"]
+    request_id = f"req_{uuid.uuid4().hex[:8]}"
+    logging.info(json.dumps({"stage": "extract", "event": "start", "index": i + 1, "total": total, "file": name, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
+    logging.info(json.dumps({"stage": "extract", "event": "template_selected", "template_id": template_id, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
+    t0 = time.time()
+    data = await aextract_chapter(client, text, name, tpl)
+    if data:
+        payload = _save_payload(book_key, cid, title, template_id, data, result_path)
+        dt = int((time.time() - t0) * 1000)
+        rel_count = len((payload or {}).get("relations", [])) if isinstance(payload, dict) else 0
+        evt_count = len((payload or {}).get("events", [])) if isinstance(payload, dict) else 0
+        total_count = rel_count + evt_count
+        logging.info(json.dumps({"stage": "extract", "event": "saved", "file": result_name, "duration_ms": dt, "template_id": template_id, "relations_count": rel_count, "events_count": evt_count, "records_total": total_count, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
+    else:
+        logging.error(json.dumps({"stage": "extract", "event": "fail", "file": name, "template_id": template_id, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
+
+async def aprocess_book(book_key: str, input_dir: str, result_dir: str, client):
     files = _list_chapter_files(input_dir)
     files_to_process = files[:LIMIT_COUNT] if LIMIT_COUNT else files
     total = len(files_to_process)
-    for i, file_path in enumerate(files_to_process):
-        name = os.path.basename(file_path)
-        m = re.match(r"^(?:chapter_\d{3}|(\d{3})_.*)\.txt$", name)
-        cid = int((m.group(1))) if m and m.group(1) else (int(re.match(r"^(\d{3})_", name).group(1)) if re.match(r"^(\d{3})_", name) else i + 1)
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        title = None
-        tm = re.match(r"^(?:chapter_\d{3}|(\d{3})_(.+))\.txt$", name)
-        if tm and tm.group(2):
-            title = tm.group(2)
-        if not title:
-            title = next((l for l in text.splitlines() if l.strip()), "")
-        tpl = _choose_template(text)
-        tpl_vars = dict(tpl.get("variables", {}))
-        tpl_vars["book"] = book_key
-        tpl["variables"] = tpl_vars
-        template_id = tpl.get("id", "relations_plus")
-        basename_id = settings.get("results", {}).get("basename_template_id", "relations_plus")
-        result_name = f"result_{cid:03d}.json" if template_id == basename_id else f"result_{cid:03d}__tpl-{template_id}.json"
-        if settings.get("results", {}).get("use_model_suffix", False):
-            base, ext = os.path.splitext(result_name)
-            result_name = f"{base}__model-{MODEL_NAME.replace(' ', '_').replace('/', '_')}{ext}"
-        result_path = os.path.join(result_dir, result_name)
-        overwrite = settings.get("results", {}).get("overwrite", False)
-        if os.path.exists(result_path) and not overwrite:
-            logging.info(json.dumps({"stage": "extract", "event": "skip", "index": i + 1, "total": total, "file": name, "chapter_id": f"{cid:03d}", "chapter_title": title, "template_id": template_id, "model_name": MODEL_NAME}, ensure_ascii=False))
-            continue
-        if os.path.exists(result_path) and overwrite:
-            logging.info(json.dumps({"stage": "extract", "event": "overwrite", "index": i + 1, "total": total, "file": name, "target": result_name, "chapter_id": f"{cid:03d}", "chapter_title": title, "template_id": template_id, "model_name": MODEL_NAME}, ensure_ascii=False))
-        request_id = f"req_{uuid.uuid4().hex[:8]}"
-        logging.info(json.dumps({"stage": "extract", "event": "start", "index": i + 1, "total": total, "file": name, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
-        logging.info(json.dumps({"stage": "extract", "event": "template_selected", "template_id": template_id, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
-        t0 = time.time()
-        data = extract_chapter(client, text, name, tpl)
-        if data:
-            bk_name = None
-            items = settings.get("corpora", {}).get("items", {})
-            if isinstance(items, dict):
-                info = items.get(book_key) or {}
-                bk_name = info.get("name") or info.get("folder")
-            if not bk_name:
-                bk_name = book_key
-            meta = {"book_key": book_key, "book_name": bk_name, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "template_id": template_id, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
-            payload = None
-            if isinstance(data, dict):
-                data["meta"] = meta
-                payload = data
-            else:
-                payload = {"relations": data, "meta": meta}
-            with open(result_path, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
-            dt = int((time.time() - t0) * 1000)
-            rel_count = len((payload or {}).get("relations", [])) if isinstance(payload, dict) else 0
-            evt_count = len((payload or {}).get("events", [])) if isinstance(payload, dict) else 0
-            total_count = rel_count + evt_count
-            logging.info(json.dumps({"stage": "extract", "event": "saved", "file": result_name, "duration_ms": dt, "template_id": template_id, "relations_count": rel_count, "events_count": evt_count, "records_total": total_count, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
-        else:
-            logging.error(json.dumps({"stage": "extract", "event": "fail", "file": name, "template_id": template_id, "chapter_id": f"{cid:03d}", "chapter_title": title, "model_name": MODEL_NAME, "request_id": request_id}, ensure_ascii=False))
+    # 有界并发：同时在途的请求数由 run.concurrency 控制
+    sem = asyncio.Semaphore(settings["run"].get("concurrency", 16))
+    async def one(i, cid, title, file_path):
+        async with sem:
+            await _aprocess_file(book_key, result_dir, client, i, total, cid, title, file_path)
+    await asyncio.gather(*(one(i, cid, title, fp) for i, (cid, title, fp) in enumerate(files_to_process)))
     logging.info(json.dumps({"stage": "extract", "event": "done"}, ensure_ascii=False))
 
-def main():
+
+# ================= Batch API 离线提取 =================
+
+def submit_batch(book_key: str, files_to_process, result_dir: str, client):
+    """将整本书的章节打包为一个 Batch API 任务提交并等待结果落盘"""
+    total = len(files_to_process)
+    targets = {}
+    lines = []
+    for i, (cid, title, file_path) in enumerate(files_to_process):
+        prep = _prepare_chapter(book_key, result_dir, i, total, cid, title, file_path)
+        if not prep:
+            continue
+        tpl = prep["tpl"]
+        custom_id = f"{book_key}:{prep['cid']:03d}:{prep['template_id']}"
+        body = {
+            "model": MODEL_NAME,
+            "messages": _build_prompt(tpl, prep["text"]),
+            "temperature": 0.1
+        }
+        lines.append(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False))
+        targets[custom_id] = prep
+    if not lines:
+        logging.info(json.dumps({"stage": "extract", "event": "batch_empty", "book_key": book_key}, ensure_ascii=False))
+        return
+    input_path = os.path.join(result_dir, "batch_input.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    logging.info(json.dumps({"stage": "extract", "event": "batch_submitted", "book_key": book_key, "batch_id": batch.id, "requests": len(lines)}, ensure_ascii=False))
+    poll_s = settings["run"].get("batch_poll_interval_s", 30)
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_s)
+        batch = client.batches.retrieve(batch.id)
+        logging.info(json.dumps({"stage": "extract", "event": "batch_poll", "batch_id": batch.id, "status": batch.status}, ensure_ascii=False))
+    if batch.status != "completed" or not batch.output_file_id:
+        logging.error(json.dumps({"stage": "extract", "event": "batch_fail", "batch_id": batch.id, "status": batch.status}, ensure_ascii=False))
+        return
+    output = client.files.content(batch.output_file_id)
+    saved = 0
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        prep = targets.get(row.get("custom_id"))
+        if not prep:
+            continue
+        resp = (row.get("response") or {}).get("body") or {}
+        try:
+            content = resp["choices"][0]["message"]["content"]
+            data = _parse_llm_content(content)
+        except Exception as e:
+            logging.error(json.dumps({"stage": "extract", "event": "batch_parse_error", "custom_id": row.get("custom_id"), "error_type": type(e).__name__, "error_message": str(e)}, ensure_ascii=False))
+            continue
+        _save_payload(book_key, prep["cid"], prep["title"], prep["template_id"], data, prep["result_path"])
+        saved += 1
+    logging.info(json.dumps({"stage": "extract", "event": "batch_done", "batch_id": batch.id, "saved": saved, "requests": len(lines)}, ensure_ascii=False))
+
+def process_book_batch(book_key: str, input_dir: str, result_dir: str, client):
+    files = _list_chapter_files(input_dir)
+    files_to_process = files[:LIMIT_COUNT] if LIMIT_COUNT else files
+    submit_batch(book_key, files_to_process, result_dir, client)
+
+def main_batch_api():
     client = get_client()
     mode = settings.get("corpora", {}).get("mode", "single")
+    if mode == "batch":
+        for bk in list_target_books(settings):
+            p = resolve_paths(settings, bk)
+            os.makedirs(p["results_dir"], exist_ok=True)
+            logging.info(json.dumps({"stage": "extract", "event": "book_start", "book_key": bk, "input_dir": p.get("chapters_dir"), "result_dir": p.get("results_dir")}, ensure_ascii=False))
+            process_book_batch(bk, p["chapters_dir"], p["results_dir"], client)
+    else:
+        os.makedirs(RESULT_DIR, exist_ok=True)
+        process_book_batch(_default_book, INPUT_DIR, RESULT_DIR, client)
+
+async def amain():
+    client = get_async_client()
+    mode = settings.get("corpora", {}).get("mode", "single")
     if mode == "batch":
         books = list_target_books(settings)
         for bk in books:
             p = resolve_paths(settings, bk)
             os.makedirs(p["results_dir"], exist_ok=True)
             logging.info(json.dumps({"stage": "extract", "event": "book_start", "book_key": bk, "input_dir": p.get("chapters_dir"), "result_dir": p.get("results_dir")}, ensure_ascii=False))
-            process_book(bk, p["chapters_dir"], p["results_dir"], client)
+            await aprocess_book(bk, p["chapters_dir"], p["results_dir"], client)
     else:
         os.makedirs(RESULT_DIR, exist_ok=True)
-        process_book(_default_book, INPUT_DIR, RESULT_DIR, client)
+        await aprocess_book(_default_book, INPUT_DIR, RESULT_DIR, client)
+
+def main():
+    # 离线批量提取走 Batch API（半价）；交互/增量提取仍走异步并发路径
+    if settings["run"].get("use_batch_api", False):
+        main_batch_api()
+    else:
+        asyncio.run(amain())
 
 
 if __name__ == "__main__":
@@ -2,9 +2,30 @@ import os
 import json
 import time
 import re
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import xxhash
+    def _hash_key(s: str) -> int:
+        return xxhash.xxh3_64_intdigest(s.encode("utf-8"))
+except ImportError:
+    # 集合只在单次请求内做并/交运算，进程内稳定的内建 hash 足够
+    _hash_key = hash
 from typing import List, Dict, Optional, Tuple, Set
+from types import MappingProxyType
+from functools import lru_cache
+from collections import defaultdict
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pydantic import BaseModel
-from .config import load_settings, resolve_paths
+from .config import load_settings, resolve_paths, register_settings_cache
+from . import result_store
+
+# result 文件名三段结构：result_<cid>[__tpl-<tpl>][__model-<model>].json
+# model 段允许带点（qwen2.5 之类），懒匹配把末尾 .json 留给文件后缀
+_RESULT_NAME_RE = re.compile(r"^result_(?P<cid>\d{3})(?:__tpl-(?P<tpl>[^.]+?))?(?:__model-(?P<model>.+?))?\.json$")
 
 class CompareChapterQuery(BaseModel):
     book: str
@@ -14,17 +35,6 @@ class CompareChapterQuery(BaseModel):
     confidence_min: float = 0.0
     include_events: bool = True
 
-class CompareMetrics(BaseModel):
-    relations_count_by_template: Dict[str, int]
-    events_count_by_template: Dict[str, int]
-    relations_union_count: int
-    relations_intersection_count: int
-    relations_jaccard: float
-    events_union_count: int
-    events_intersection_count: int
-    events_jaccard: float
-    by_relation_type: Dict[str, Dict[str, int]]
-
 class CompareBatchQuery(BaseModel):
     book: str
     chapter_ids: Optional[List[str]] = None
@@ -33,20 +43,28 @@ class CompareBatchQuery(BaseModel):
     model_name: Optional[str] = None
     confidence_min: float = 0.0
     include_events: bool = True
+    summary_only: bool = False
+    stream: bool = False
 
-def _merge_synonyms(settings: dict, tpl_ids: List[str]) -> Dict[str, str]:
+# 同义词/别名规则对一组模板是静态的；按模板集合缓存，避免批量比较时
+# 每章节重复合并字典并重新 re.compile
+@lru_cache(maxsize=64)
+def _merge_synonyms(tpl_ids_key: Tuple[str, ...]) -> Dict[str, str]:
+    settings = load_settings()
     m: Dict[str, str] = {}
     for t in settings.get("prompts", {}).get("templates", []):
-        if t.get("id") in tpl_ids:
+        if t.get("id") in tpl_ids_key:
             for k, v in (t.get("variables", {}).get("synonyms_map", {}) or {}).items():
                 m[k] = v
-    return m
+    return MappingProxyType(m)
 
-def _collect_alias_rules(settings: dict, tpl_ids: List[str]) -> Dict[str, List]:
+@lru_cache(maxsize=64)
+def _collect_alias_rules(tpl_ids_key: Tuple[str, ...]) -> Dict[str, tuple]:
+    settings = load_settings()
     strip_tokens: List[str] = []
     regex_rules: List[Tuple[re.Pattern, str]] = []
     for t in settings.get("prompts", {}).get("templates", []):
-        if t.get("id") in tpl_ids:
+        if t.get("id") in tpl_ids_key:
             rules = (t.get("variables", {}).get("alias_rules", []) or [])
             for r in rules:
                 if isinstance(r, str):
@@ -63,34 +81,67 @@ def _collect_alias_rules(settings: dict, tpl_ids: List[str]) -> Dict[str, List]:
                                 regex_rules.append((re.compile(pat.strip()), rep))
                             except Exception:
                                 pass
-    return {"strip_tokens": strip_tokens, "regex_rules": regex_rules}
+    return MappingProxyType({"strip_tokens": tuple(strip_tokens), "regex_rules": tuple(regex_rules)})
 
-def _canonical(name: str, syn: Dict[str, str], alias: Dict[str, List]) -> str:
-    n = name.strip()
-    for pat, rep in alias.get("regex_rules", []):
+@lru_cache(maxsize=64)
+def _build_canonicalizer(tpl_ids_key: Tuple[str, ...]):
+    """把同义词与别名规则编译为单遍归一化闭包：所有 regex 规则合并为
+    一个命名分组的交替式，一次 sub 完成；替换串按字面量处理，
+    含反向引用（\\1 等）的规则组退回逐条 sub"""
+    syn = _merge_synonyms(tpl_ids_key)
+    alias = _collect_alias_rules(tpl_ids_key)
+    regex_rules = alias.get("regex_rules", ())
+    strip_tokens = alias.get("strip_tokens", ())
+    combined = None
+    name_to_rep: Dict[str, str] = {}
+    if regex_rules and all("\\" not in rep for _, rep in regex_rules):
+        name_to_rep = {f"c{i}": rep for i, (_, rep) in enumerate(regex_rules)}
         try:
-            n = pat.sub(rep, n)
-        except Exception:
-            pass
-    n = syn.get(n, n)
-    for tok in alias.get("strip_tokens", []):
-        if n.startswith(tok):
-            n = n[len(tok):]
-        if n.endswith(tok):
-            n = n[:-len(tok)]
-    return n.strip()
+            combined = re.compile("|".join(f"(?P<c{i}>{pat.pattern})" for i, (pat, _) in enumerate(regex_rules)))
+        except re.error:
+            combined = None
+    names = tuple(name_to_rep.keys())
+    def _sub_one(m: re.Match) -> str:
+        for nm in names:
+            if m.group(nm) is not None:
+                return name_to_rep[nm]
+        return m.group(0)
+    def canon(name: str) -> str:
+        n = name.strip()
+        if combined is not None:
+            n = combined.sub(_sub_one, n)
+        else:
+            for pat, rep in regex_rules:
+                try:
+                    n = pat.sub(rep, n)
+                except Exception:
+                    pass
+        n = syn.get(n, n)
+        for tok in strip_tokens:
+            if n.startswith(tok):
+                n = n[len(tok):]
+            if n.endswith(tok):
+                n = n[:-len(tok)]
+        return n.strip()
+    return canon
+
+# 三个缓存按模板组合键存的是 settings 内容的编译产物；
+# settings 换代（改盘上文件或 /admin/reload）时随之清空
+register_settings_cache(_merge_synonyms.cache_clear)
+register_settings_cache(_collect_alias_rules.cache_clear)
+register_settings_cache(_build_canonicalizer.cache_clear)
 
 def _read_result(path: str) -> Optional[Dict]:
     if not os.path.exists(path):
         return None
-    with open(path, "r", encoding="utf-8") as f:
+    with open(path, "rb") as f:
         s = f.read().strip()
-        if not s:
-            return None
-        try:
-            return json.loads(s)
-        except:
-            return None
+    if not s:
+        return None
+    try:
+        return orjson.loads(s) if orjson else json.loads(s)
+    except:
+        return None
 
 def _result_path(base_dir: str, cid: str, default_tpl: str, tpl_id: Optional[str], model_name: Optional[str]) -> str:
     name = f"result_{cid}.json" if not tpl_id or tpl_id == default_tpl else f"result_{cid}__tpl-{tpl_id}.json"
@@ -99,21 +150,30 @@ def _result_path(base_dir: str, cid: str, default_tpl: str, tpl_id: Optional[str
         name = f"{base}__model-{model_name.replace(' ', '_').replace('/', '_')}{ext}"
     return os.path.join(base_dir, name)
 
-def _candidate_paths(base_dir: str, cid: str, default_tpl: str, tpl_id: Optional[str], settings: dict, model_name_hint: Optional[str]) -> List[str]:
-    paths: List[str] = []
+def _candidate_paths(base_dir: str, cid: str, default_tpl: str, tpl_id: Optional[str], settings: dict, model_name_hint: Optional[str], existing: Optional[Set[str]] = None) -> List[str]:
+    names: List[str] = []
     name_tpl = tpl_id if tpl_id and tpl_id != default_tpl else None
     use_suffix = settings.get("results", {}).get("use_model_suffix", False)
     lm_name = model_name_hint or settings.get("llm", {}).get("model_name")
     base = f"result_{cid}.json" if not name_tpl else f"result_{cid}__tpl-{name_tpl}.json"
-    paths.append(os.path.join(base_dir, base))
+    names.append(base)
     if use_suffix and lm_name:
         b, e = os.path.splitext(base)
-        paths.append(os.path.join(base_dir, f"{b}__model-{lm_name.replace(' ', '_').replace('/', '_')}{e}"))
-    return paths
+        names.append(f"{b}__model-{lm_name.replace(' ', '_').replace('/', '_')}{e}")
+    # 已知目录清单时先做集合判定，省掉对不存在文件的 stat/open 系统调用
+    if existing is not None:
+        names = [n for n in names if n in existing]
+    return [os.path.join(base_dir, n) for n in names]
+
+def _list_existing(base_dir: str) -> Set[str]:
+    try:
+        return set(os.listdir(base_dir))
+    except OSError:
+        return set()
 
-def _parse_relations(data, syn: Dict[str, str], alias: Dict[str, List], confidence_min: float) -> Tuple[List[Dict], Set[str], Dict[str, int]]:
+def _parse_relations(data, canon, confidence_min: float, key_to_str: Optional[Dict[int, str]] = None) -> Tuple[List[Dict], Set[int], Dict[str, int]]:
     items: List[Dict] = []
-    keys: Set[str] = set()
+    keys: Set[int] = set()
     by_type: Dict[str, int] = {}
     seq = []
     if isinstance(data, list):
@@ -121,8 +181,8 @@ def _parse_relations(data, syn: Dict[str, str], alias: Dict[str, List], confiden
     elif isinstance(data, dict):
         seq = data.get("relations", [])
     for r in seq:
-        head = _canonical(str(r.get("head", "")), syn, alias)
-        tail = _canonical(str(r.get("tail", "")), syn, alias)
+        head = canon(str(r.get("head", "")))
+        tail = canon(str(r.get("tail", "")))
         head_type = str(r.get("head_type", ""))
         tail_type = str(r.get("tail_type", ""))
         relation = str(r.get("relation", ""))
@@ -131,15 +191,18 @@ def _parse_relations(data, syn: Dict[str, str], alias: Dict[str, List], confiden
             continue
         q = r.get("qualifiers", {}) or {}
         ev = r.get("evidence", None)
-        key = "|".join([head, head_type, relation, tail, tail_type])
+        key_str = "|".join([head, head_type, relation, tail, tail_type])
+        key = _hash_key(key_str)
         keys.add(key)
+        if key_to_str is not None:
+            key_to_str[key] = key_str
         items.append({"head": head, "head_type": head_type, "relation": relation, "tail": tail, "tail_type": tail_type, "confidence": conf, "qualifiers": q, "evidence": ev})
         by_type[relation] = by_type.get(relation, 0) + 1
     return items, keys, by_type
 
-def _parse_events(data, syn: Dict[str, str], alias: Dict[str, List], confidence_min: float) -> Tuple[List[Dict], Set[str]]:
+def _parse_events(data, canon, confidence_min: float, key_to_str: Optional[Dict[int, str]] = None) -> Tuple[List[Dict], Set[int]]:
     items: List[Dict] = []
-    keys: Set[str] = set()
+    keys: Set[int] = set()
     seq = []
     if isinstance(data, dict):
         seq = data.get("events", [])
@@ -148,17 +211,33 @@ def _parse_events(data, syn: Dict[str, str], alias: Dict[str, List], confidence_
         parts = e.get("participants", {}) or {}
         norm_parts: Dict[str, List[str]] = {}
         for role, names in parts.items():
-            norm_parts[role] = [ _canonical(str(x), syn, alias) for x in (names or []) ]
+            norm_parts[role] = [ canon(str(x)) for x in (names or []) ]
         ev = e.get("evidence", None)
         conf = e.get("confidence", None)
         if conf is not None and conf < confidence_min:
             continue
         role_sets = ",".join([ f"{role}:{','.join(norm_parts.get(role, []))}" for role in sorted(norm_parts.keys()) ])
-        key = "|".join([et, role_sets])
+        key_str = "|".join([et, role_sets])
+        key = _hash_key(key_str)
         keys.add(key)
+        if key_to_str is not None:
+            key_to_str[key] = key_str
         items.append({"event_type": et, "participants": norm_parts, "evidence": ev, "confidence": conf})
     return items, keys
 
+def _sample_keys(sets_by_tpl: Dict[str, Set[int]], key_to_str: Dict[int, str], limit: int = 10) -> List[Dict]:
+    """边遍历边去重取前 limit 个样例，不物化完整并集"""
+    seen: Set[int] = set()
+    out: List[Dict] = []
+    for k in chain.from_iterable(sets_by_tpl.values()):
+        if k in seen:
+            continue
+        seen.add(k)
+        out.append({"key": key_to_str[k]})
+        if len(out) == limit:
+            break
+    return out
+
 def _jaccard(a: Set[str], b: Set[str]) -> float:
     if not a and not b:
         return 1.0
@@ -166,86 +245,106 @@ def _jaccard(a: Set[str], b: Set[str]) -> float:
     i = len(a & b)
     return i / u if u else 0.0
 
-def compare_chapter(query: CompareChapterQuery) -> Dict:
+def compare_chapter(query: CompareChapterQuery, existing: Optional[Set[str]] = None, summary_only: bool = False) -> Dict:
+    return _compare_chapter_impl(query.book, query.chapter_id, query.templates, query.model_name, query.confidence_min, query.include_events, existing, summary_only)
+
+def _compare_chapter_impl(book: str, chapter_id: str, templates: List[str], model_name: Optional[str], confidence_min: float, include_events: bool, existing: Optional[Set[str]] = None, summary_only: bool = False) -> Dict:
+    """compare_chapter 的纯参数实现；批量路径直接调用，绕开 pydantic 构造"""
     settings = load_settings()
-    p = resolve_paths(settings, query.book)
+    p = resolve_paths(settings, book)
     base_dir = p["results_dir"]
+    if existing is None:
+        existing = _list_existing(base_dir)
     default_tpl = settings.get("prompts", {}).get("selected", "relations_plus")
-    cid = query.chapter_id
-    tpl_ids = query.templates
-    syn = _merge_synonyms(settings, tpl_ids)
-    alias = _collect_alias_rules(settings, tpl_ids)
+    cid = chapter_id
+    tpl_ids = templates
+    tpl_ids_key = tuple(sorted(tpl_ids))
+    canon = _build_canonicalizer(tpl_ids_key)
     rel_counts: Dict[str, int] = {}
     evt_counts: Dict[str, int] = {}
-    rel_sets: Dict[str, Set[str]] = {}
-    evt_sets: Dict[str, Set[str]] = {}
+    rel_sets: Dict[str, Set[int]] = {}
+    evt_sets: Dict[str, Set[int]] = {}
     by_rel_type_all: Dict[str, Dict[str, int]] = {}
+    # 集合元素是 64 位整型哈希；展示用原文在 key_to_str 按需回查
+    key_to_str: Optional[Dict[int, str]] = None if summary_only else {}
+    backend = settings.get("results", {}).get("backend", "files")
     for tpl in tpl_ids:
-        files = _candidate_paths(base_dir, cid, default_tpl, tpl, settings, query.model_name)
-        data = None
-        for fp in files:
-            data = _read_result(fp)
-            if data:
-                break
-        rel_items, rel_keys, by_rel_type = _parse_relations(data or [], syn, alias, query.confidence_min)
-        evt_items, evt_keys = _parse_events(data or {}, syn, alias, query.confidence_min) if query.include_events else ([], set())
+        if backend == "sqlite":
+            data = result_store.load_result(base_dir, cid, tpl, model_name)
+        else:
+            files = _candidate_paths(base_dir, cid, default_tpl, tpl, settings, model_name, existing)
+            data = None
+            for fp in files:
+                data = _read_result(fp)
+                if data:
+                    break
+        rel_items, rel_keys, by_rel_type = _parse_relations(data or [], canon, confidence_min, key_to_str)
+        evt_items, evt_keys = _parse_events(data or {}, canon, confidence_min, key_to_str) if include_events else ([], set())
         rel_counts[tpl] = len(rel_items)
         evt_counts[tpl] = len(evt_items)
         rel_sets[tpl] = rel_keys
         evt_sets[tpl] = evt_keys
         by_rel_type_all[tpl] = by_rel_type
-    rel_union = set().union(*rel_sets.values()) if rel_sets else set()
-    evt_union = set().union(*evt_sets.values()) if evt_sets else set()
     rel_inter = set.intersection(*rel_sets.values()) if rel_sets and len(rel_sets) > 1 else set()
     evt_inter = set.intersection(*evt_sets.values()) if evt_sets and len(evt_sets) > 1 else set()
+    if len(tpl_ids) == 2:
+        # 两模板场景用容斥原理算并集大小，省掉整份并集的分配
+        a, b = tpl_ids[0], tpl_ids[1]
+        rel_union_count = len(rel_sets[a]) + len(rel_sets[b]) - len(rel_inter)
+        evt_union_count = len(evt_sets[a]) + len(evt_sets[b]) - len(evt_inter)
+    else:
+        rel_union_count = len(set().union(*rel_sets.values())) if rel_sets else 0
+        evt_union_count = len(set().union(*evt_sets.values())) if evt_sets else 0
     rel_j = 0.0
     evt_j = 0.0
     if len(tpl_ids) == 2:
         rel_j = _jaccard(rel_sets[tpl_ids[0]], rel_sets[tpl_ids[1]])
         evt_j = _jaccard(evt_sets[tpl_ids[0]], evt_sets[tpl_ids[1]])
-    diffs_rel_unique: Dict[str, List[str]] = {}
-    diffs_evt_unique: Dict[str, List[str]] = {}
-    for tpl in tpl_ids:
-        diffs_rel_unique[tpl] = list(rel_sets[tpl] - rel_inter)
-        diffs_evt_unique[tpl] = list(evt_sets[tpl] - evt_inter)
     by_relation_type: Dict[str, Dict[str, int]] = {}
-    types = set()
-    for tpl in tpl_ids:
-        types |= set(by_rel_type_all[tpl].keys())
-    for t in types:
-        by_relation_type[t] = {}
+    if summary_only:
+        # 汇总模式：跳过逐模板差集/样例/关系类型分布，内存占用与模板数无关
+        diffs = {}
+        samples = {}
+    else:
+        diffs_rel_unique: Dict[str, List[str]] = {}
+        diffs_evt_unique: Dict[str, List[str]] = {}
         for tpl in tpl_ids:
-            by_relation_type[t][tpl] = by_rel_type_all[tpl].get(t, 0)
-        by_relation_type[t]["union"] = sum([ by_rel_type_all[tpl].get(t, 0) for tpl in tpl_ids ])
-        by_relation_type[t]["intersection"] = min([ by_rel_type_all[tpl].get(t, 0) for tpl in tpl_ids ]) if tpl_ids else 0
-    samples_rel = [{"key": k} for k in list(rel_union)[:10]]
-    samples_evt = [{"key": k} for k in list(evt_union)[:10]]
+            diffs_rel_unique[tpl] = [key_to_str[k] for k in rel_sets[tpl] - rel_inter]
+            diffs_evt_unique[tpl] = [key_to_str[k] for k in evt_sets[tpl] - evt_inter]
+        # 一次遍历同时算出各模板计数、union 与 intersection
+        all_types = set().union(*[m.keys() for m in by_rel_type_all.values()]) if by_rel_type_all else set()
+        for t in all_types:
+            counts = [by_rel_type_all[tpl].get(t, 0) for tpl in tpl_ids]
+            by_relation_type[t] = {**dict(zip(tpl_ids, counts)), "union": sum(counts), "intersection": min(counts) if counts else 0}
+        samples_rel = _sample_keys(rel_sets, key_to_str)
+        samples_evt = _sample_keys(evt_sets, key_to_str)
+        diffs = {
+            "relations_unique": diffs_rel_unique,
+            "relations_intersection": [key_to_str[k] for k in rel_inter],
+            "events_unique": diffs_evt_unique,
+            "events_intersection": [key_to_str[k] for k in evt_inter]
+        }
+        samples = {"relations": samples_rel, "events": samples_evt}
     meta = {
-        "book": query.book,
+        "book": book,
         "chapter_id": cid,
         "templates": ",".join(tpl_ids),
-        "model_name": query.model_name or "",
-        "filters": json.dumps({"confidence_min": query.confidence_min, "include_events": query.include_events}, ensure_ascii=False),
+        "model_name": model_name or "",
+        "filters": json.dumps({"confidence_min": confidence_min, "include_events": include_events}, ensure_ascii=False),
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     }
-    metrics = CompareMetrics(
-        relations_count_by_template=rel_counts,
-        events_count_by_template=evt_counts,
-        relations_union_count=len(rel_union),
-        relations_intersection_count=len(rel_inter),
-        relations_jaccard=rel_j,
-        events_union_count=len(evt_union),
-        events_intersection_count=len(evt_inter),
-        events_jaccard=evt_j,
-        by_relation_type=by_relation_type
-    ).dict()
-    diffs = {
-        "relations_unique": diffs_rel_unique,
-        "relations_intersection": list(rel_inter),
-        "events_unique": diffs_evt_unique,
-        "events_intersection": list(evt_inter)
+    # 直接构造 dict，跳过 pydantic 模型校验（热路径每章都要走一次）
+    metrics = {
+        "relations_count_by_template": rel_counts,
+        "events_count_by_template": evt_counts,
+        "relations_union_count": rel_union_count,
+        "relations_intersection_count": len(rel_inter),
+        "relations_jaccard": rel_j,
+        "events_union_count": evt_union_count,
+        "events_intersection_count": len(evt_inter),
+        "events_jaccard": evt_j,
+        "by_relation_type": by_relation_type,
     }
-    samples = {"relations": samples_rel, "events": samples_evt}
     return {"meta": meta, "metrics": metrics, "diffs": diffs, "samples": samples}
 
 def compare_overview(book: str) -> Dict:
@@ -254,32 +353,27 @@ def compare_overview(book: str) -> Dict:
     base_dir = p["results_dir"]
     default_tpl = settings.get("prompts", {}).get("selected", "relations_plus")
     tpl_ids = [t.get("id") for t in settings.get("prompts", {}).get("templates", [])]
-    files = [f for f in os.listdir(base_dir) if f.endswith(".json")]
-    chapters = {}
+    chapters = defaultdict(lambda: {"templates": set(), "files": []})
     models = set()
-    for name in files:
-        m = None
-        if name.startswith("result_"):
-            if "__tpl-" in name:
-                m = name.split("result_")[1].split("__tpl-")
-                cid = m[0]
-                rest = m[1]
-                tpl = rest.split(".json")[0]
-                if "__model-" in tpl:
-                    tpl, mod = tpl.split("__model-")
+    if settings.get("results", {}).get("backend", "files") == "sqlite":
+        for cid, tpl, mod in result_store.list_results(base_dir):
+            if mod:
+                models.add(mod)
+            chapters[cid]["templates"].add(tpl)
+            chapters[cid]["files"].append(f"results.db:{cid}:{tpl}")
+    else:
+        with os.scandir(base_dir) as it:
+            for entry in it:
+                m = _RESULT_NAME_RE.match(entry.name)
+                if not m:
+                    continue
+                cid = m.group("cid")
+                tpl = m.group("tpl") or default_tpl
+                mod = m.group("model")
+                if mod:
                     models.add(mod)
-                chapters.setdefault(cid, {"templates": set(), "files": []})
                 chapters[cid]["templates"].add(tpl)
-                chapters[cid]["files"].append(name)
-            else:
-                cid_full = name.split("result_")[1].split(".json")[0]
-                cid = cid_full.split("__model-")[0]
-                tpl = default_tpl
-                chapters.setdefault(cid, {"templates": set(), "files": []})
-                chapters[cid]["templates"].add(tpl)
-                chapters[cid]["files"].append(name)
-                if "__model-" in cid_full:
-                    models.add(cid_full.split("__model-")[1])
+                chapters[cid]["files"].append(entry.name)
     overview = {
         "meta": {"book": book, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
         "templates": tpl_ids,
@@ -289,11 +383,7 @@ def compare_overview(book: str) -> Dict:
     }
     return overview
 
-def compare_batch(payload: CompareBatchQuery) -> Dict:
-    settings = load_settings()
-    p = resolve_paths(settings, payload.book)
-    base_dir = p["results_dir"]
-    default_tpl = settings.get("prompts", {}).get("selected", "relations_plus")
+def _resolve_chapter_ids(payload: CompareBatchQuery) -> List[str]:
     ids = payload.chapter_ids or []
     if not ids and payload.chapter_range and len(payload.chapter_range) == 2:
         try:
@@ -302,14 +392,43 @@ def compare_batch(payload: CompareBatchQuery) -> Dict:
             ids = [f"{i:03d}" for i in range(start, end + 1)]
         except:
             ids = []
+    return ids
+
+def compare_batch_iter(payload: CompareBatchQuery):
+    """逐章节产出批量比较结果行；并发读取但按请求顺序输出"""
+    settings = load_settings()
+    p = resolve_paths(settings, payload.book)
+    ids = _resolve_chapter_ids(payload)
+    if not ids:
+        return
+    # 目录清单在批量级别读一次，传给各章节复用
+    existing = _list_existing(p["results_dir"])
+    with ThreadPoolExecutor(max_workers=min(32, len(ids))) as ex:
+        futs = {cid: ex.submit(_compare_chapter_impl, payload.book, cid, payload.templates, payload.model_name, payload.confidence_min, payload.include_events, existing, payload.summary_only) for cid in ids}
+        for cid in ids:
+            res = futs[cid].result()
+            row = {"chapter_id": cid, "metrics": res["metrics"]}
+            if not payload.summary_only:
+                row["diffs"] = res["diffs"]
+                row["samples"] = res["samples"]
+            yield row
+
+def compare_batch_stream(payload: CompareBatchQuery):
+    """NDJSON 流式输出：一行一个章节，避免整批结果驻留内存"""
+    for row in compare_batch_iter(payload):
+        if orjson is not None:
+            yield orjson.dumps(row) + b"\n"
+        else:
+            yield (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+def compare_batch(payload: CompareBatchQuery) -> Dict:
+    ids = _resolve_chapter_ids(payload)
     per = []
     rel_sum = {tpl: 0 for tpl in payload.templates}
     evt_sum = {tpl: 0 for tpl in payload.templates}
-    for cid in ids:
-        q = CompareChapterQuery(book=payload.book, chapter_id=cid, templates=payload.templates, model_name=payload.model_name, confidence_min=payload.confidence_min, include_events=payload.include_events)
-        res = compare_chapter(q)
-        per.append({"chapter_id": cid, "metrics": res["metrics"], "diffs": res["diffs"], "samples": res["samples"]})
-        m = res["metrics"]
+    for row in compare_batch_iter(payload):
+        per.append(row)
+        m = row["metrics"]
         for tpl, cnt in m["relations_count_by_template"].items():
             rel_sum[tpl] = rel_sum.get(tpl, 0) + cnt
         for tpl, cnt in m.get("events_count_by_template", {}).items():
@@ -338,10 +457,14 @@ def compare_batch_books(payload: CompareBatchBooksQuery) -> Dict:
     out = {}
     rel_total = {tpl: 0 for tpl in payload.templates}
     evt_total = {tpl: 0 for tpl in payload.templates}
+    # 书与书之间同样并发展开
+    if books:
+        with ThreadPoolExecutor(max_workers=min(8, len(books))) as ex:
+            futs = {ex.submit(compare_batch, CompareBatchQuery(book=bk, chapter_ids=payload.chapter_ids, chapter_range=payload.chapter_range, templates=payload.templates, model_name=payload.model_name, confidence_min=payload.confidence_min, include_events=payload.include_events)): bk for bk in books}
+            for f in as_completed(futs):
+                out[futs[f]] = f.result()
     for bk in books:
-        q = CompareBatchQuery(book=bk, chapter_ids=payload.chapter_ids, chapter_range=payload.chapter_range, templates=payload.templates, model_name=payload.model_name, confidence_min=payload.confidence_min, include_events=payload.include_events)
-        r = compare_batch(q)
-        out[bk] = r
+        r = out[bk]
         s = r.get("summary", {})
         for tpl, cnt in (s.get("relations_count_by_template", {}) or {}).items():
             rel_total[tpl] = rel_total.get(tpl, 0) + cnt
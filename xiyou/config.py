@@ -1,18 +1,56 @@
 import os
 import re
 
+_BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# 进程内环境变量基本不变，读一次后缓存，省去每次 load/reload 的重复查询
+_env_cache: dict = {}
+
+def _env_get(env_key: str):
+    if env_key not in _env_cache:
+        _env_cache[env_key] = os.environ.get(env_key)
+    return _env_cache[env_key]
+
+def _env_or(value, env_key: str, default=None, prefer_env: bool = True):
+    env_val = _env_get(env_key)
+    if prefer_env and env_val:
+        return env_val
+    if isinstance(value, str):
+        m = re.fullmatch(r"\$\{([A-Z0-9_]+)\}", value.strip())
+        if m:
+            v = _env_get(m.group(1))
+            if v:
+                return v
+            return default
+    return value if value is not None else default
+
+def _set_defaults(d: dict, defaults: dict) -> dict:
+    """一趟补齐缺省键，替代成串的 setdefault"""
+    for k, v in defaults.items():
+        if k not in d:
+            d[k] = v
+    return d
+
 def _load_yaml(path):
     try:
         import yaml
     except Exception:
         return None
+    # LibYAML 的 C 解析器比纯 Python SafeLoader 快一个数量级，能装上就用
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
     try:
         with open(path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f) or {}
+            return yaml.load(f, Loader=loader) or {}
     except Exception:
         return None
 
 def _load_toml(path):
+    try:
+        import rtoml
+        with open(path, "r", encoding="utf-8") as f:
+            return rtoml.load(f) or {}
+    except Exception:
+        pass
     try:
         import tomllib
     except Exception:
@@ -23,94 +61,140 @@ def _load_toml(path):
     except Exception:
         return None
 
+# 配置文件路径只探测一次；后续 load_settings 直接 stat 该路径拿 mtime
+_SETTINGS_PATH: str | None = None
+
+def _find_settings_path():
+    global _SETTINGS_PATH
+    if _SETTINGS_PATH is not None and os.path.isfile(_SETTINGS_PATH):
+        return _SETTINGS_PATH
+    cwd = os.getcwd()
+    candidates = [
+        os.path.join(root, name)
+        for name in ("settings.yaml", "settings.yml", "settings.toml")
+        for root in (cwd, _BASE_DIR)
+    ]
+    _SETTINGS_PATH = next((p for p in candidates if os.path.isfile(p)), None)
+    return _SETTINGS_PATH
+
+# 当前缓存的 settings 及其 (path, mtime) 代次标识
+_settings_key = None
+_settings_value = None
+
+# 依赖 settings 内容的下游缓存在此登记清理回调（比较侧的同义词/
+# 别名规则缓存等），settings 换代时与 _resolve_cache 一起清空，
+# 避免改盘上配置或 /admin/reload 之后继续用旧编译产物
+_dependent_cache_clearers: list = []
+
+def register_settings_cache(clear_fn):
+    _dependent_cache_clearers.append(clear_fn)
+
+def _clear_dependent_caches():
+    _resolve_cache.clear()
+    for fn in _dependent_cache_clearers:
+        fn()
+
 def load_settings():
+    global _settings_key, _settings_value
+    path = _find_settings_path()
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns if path else 0
+    except OSError:
+        mtime_ns = 0
+    key = (path, mtime_ns)
+    if _settings_value is None or key != _settings_key:
+        # 先清下游缓存再构建：旧 settings dict 此时仍被引用，
+        # 新 dict 不可能复用其 id，(id, book) 键不会串代
+        _clear_dependent_caches()
+        _settings_value = _load_settings_impl(path)
+        _settings_key = key
+    return _settings_value
+
+def _load_settings_impl(path):
     try:
         from dotenv import load_dotenv
         load_dotenv()
     except Exception:
         pass
-    cwd = os.getcwd()
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
     data = {}
-    for name in ("settings.yaml", "settings.yml"):
-        for root in (cwd, base_dir):
-            p = os.path.join(root, name)
-            if os.path.exists(p):
-                y = _load_yaml(p)
-                if y:
-                    data.update(y)
-                    break
-        if data:
-            break
-    if not data:
-        for root in (cwd, base_dir):
-            p = os.path.join(root, "settings.toml")
-            if os.path.exists(p):
-                t = _load_toml(p)
-                if t:
-                    data.update(t)
-                    break
-    llm = data.get("llm", {})
-    corpora = data.get("corpora", {})
-    run = data.get("run", {})
-    naming = data.get("naming", {})
-    neo4j = data.get("neo4j", {})
-    prompts = data.get("prompts", {})
-    results = data.get("results", {})
-    def _env_or(value: str | None, env_key: str, default: str | None = None, prefer_env: bool = True):
-        env_val = os.environ.get(env_key)
-        if prefer_env and env_val:
-            return env_val
-        if isinstance(value, str):
-            m = re.fullmatch(r"\$\{([A-Z0-9_]+)\}", value.strip())
-            if m:
-                v = os.environ.get(m.group(1))
-                if v:
-                    return v
-                return default
-        return value if value is not None else default
+    if path:
+        loaded = _load_toml(path) if path.endswith(".toml") else _load_yaml(path)
+        if loaded:
+            data.update(loaded)
+    # `get(k) or {}` 同时兜住键缺失和 YAML 空段落（值为 None）两种情况
+    llm = data.get("llm") or {}
+    corpora = data.get("corpora") or {}
+    run = data.get("run") or {}
+    naming = data.get("naming") or {}
+    neo4j = data.get("neo4j") or {}
+    prompts = data.get("prompts") or {}
+    results = data.get("results") or {}
     llm["api_key"] = _env_or(llm.get("api_key"), "LLM_API_KEY", default=None, prefer_env=True)
     llm["base_url"] = _env_or(llm.get("base_url"), "LLM_BASE_URL", default=llm.get("base_url"), prefer_env=False)
     llm["model_name"] = _env_or(llm.get("model_name"), "LLM_MODEL_NAME", default=llm.get("model_name", "qwen-plus"), prefer_env=False)
-    corpora.setdefault("mode", "single")
-    corpora.setdefault("base_dir", "data")
-    corpora.setdefault("items", {})
+    _set_defaults(corpora, {"mode": "single", "base_dir": "data", "items": {}})
     if corpora.get("mode") == "single" and not corpora.get("default"):
         items = corpora.get("items", {})
         if isinstance(items, dict) and items:
             corpora["default"] = next(iter(items.keys()))
-    run.setdefault("limit_count", 3)
-    run.setdefault("timeout_ms", 20000)
-    naming.setdefault("mode", os.environ.get("NAMING_MODE", "TITLE_PREFIXED"))
-    prompts.setdefault("selected", "relations_plus")
-    selectors = prompts.get("selectors", {})
-    selectors.setdefault("length_threshold", 8000)
-    selectors.setdefault("dialogue_ratio_threshold", 0.50)
+    _set_defaults(run, {
+        "limit_count": 3,
+        "timeout_ms": 20000,
+        "concurrency": 16,
+        "use_batch_api": False,
+        "batch_poll_interval_s": 30,
+        "semantic_cache_threshold": 0.0,
+    })
+    _set_defaults(naming, {"mode": os.environ.get("NAMING_MODE", "TITLE_PREFIXED")})
+    _set_defaults(prompts, {
+        "selected": "relations_plus",
+        "selection_mode": "static",
+        "dynamic": {"override_to": "events_relations"},
+    })
+    selectors = prompts.get("selectors") or {}
+    _set_defaults(selectors, {"length_threshold": 8000, "dialogue_ratio_threshold": 0.50})
     prompts["selectors"] = selectors
-    prompts.setdefault("selection_mode", "static")
-    prompts.setdefault("dynamic", {"override_to": "events_relations"})
-    templates = prompts.get("templates", [])
-    prompts["templates"] = templates
-    results.setdefault("use_model_suffix", False)
-    results.setdefault("overwrite", False)
-    results.setdefault("basename_template_id", "relations_plus")
+    prompts["templates"] = prompts.get("templates") or []
+    _set_defaults(results, {
+        "use_model_suffix": False,
+        "overwrite": False,
+        "basename_template_id": "relations_plus",
+        "backend": "files",
+    })
     neo4j["uri"] = _env_or(neo4j.get("uri"), "NEO4J_URI", default=neo4j.get("uri"), prefer_env=False)
     neo4j["user"] = _env_or(neo4j.get("user"), "NEO4J_USER", default=neo4j.get("user"), prefer_env=False)
     neo4j["password"] = _env_or(neo4j.get("password"), "NEO4J_PASSWORD", default=None, prefer_env=True)
     return {"llm": llm, "corpora": corpora, "run": run, "naming": naming, "neo4j": neo4j, "prompts": prompts, "results": results}
 
+def reload_settings():
+    """清空配置缓存；下次 load_settings 重新探测路径并读盘"""
+    global _SETTINGS_PATH, _settings_key, _settings_value
+    _SETTINGS_PATH = None
+    _settings_key = None
+    _settings_value = None
+    _env_cache.clear()
+    _clear_dependent_caches()
+
+_resolve_cache: dict = {}
+
 def resolve_paths(cfg: dict, book_key: str) -> dict:
+    cache_key = (id(cfg), book_key)
+    hit = _resolve_cache.get(cache_key)
+    if hit is not None:
+        return hit
     corp = cfg.get("corpora", {})
     items = corp.get("items", {})
     base_dir = corp.get("base_dir") or "data"
-    base_dir = base_dir if os.path.isabs(base_dir) else os.path.normpath(os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")), base_dir))
+    base_dir = base_dir if os.path.isabs(base_dir) else os.path.normpath(os.path.join(_BASE_DIR, base_dir))
     info = items.get(book_key, {})
     folder = info.get("folder") or info.get("name") or book_key
     raw_dir = os.path.join(base_dir, folder)
     chapters_dir = raw_dir
     results_dir = os.path.join(raw_dir, "results")
     raw_file = os.path.join(raw_dir, info.get("raw_file") or f"{book_key}.txt")
-    return {"raw_dir": raw_dir, "chapters_dir": chapters_dir, "results_dir": results_dir, "raw_file": raw_file}
+    res = {"raw_dir": raw_dir, "chapters_dir": chapters_dir, "results_dir": results_dir, "raw_file": raw_file}
+    _resolve_cache[cache_key] = res
+    return res
 
 def list_target_books(cfg: dict) -> list:
     corp = cfg.get("corpora", {})
@@ -1,9 +1,22 @@
 import os
+import csv
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
+try:
+    import orjson
+    def _dumps(obj) -> str:
+        # orjson 产出 bytes；qualifiers/participants 属性要存 str
+        return orjson.dumps(obj).decode("utf-8")
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+    _loads = json.loads
 from neo4j import GraphDatabase
 from xiyou.config import load_settings, resolve_paths, list_target_books
-from xiyou.normalize_adapter import normalize_output, calibrate_relations, fuse_relations, collect_entities
+from xiyou.normalize_adapter import normalize_output, parse_alias_rules, iter_calibrated, RelationFuser
+from xiyou import result_store
 
 
 class Neo4jIngestor:
@@ -19,89 +32,220 @@ class Neo4jIngestor:
 
     def ensure_constraints(self):
         with self.driver.session() as session:
-            session.run("CREATE CONSTRAINT entity_unique IF NOT EXISTS FOR (e:Entity) REQUIRE (e.name, e.type) IS UNIQUE")
+            # 写入只用 {name:...} MERGE 且从不设置 e.type，旧的 (name, type)
+            # 复合约束纯属每次写入多维护一个索引，存量库顺手清掉
+            session.run("DROP CONSTRAINT entity_unique IF EXISTS")
             session.run("CREATE CONSTRAINT entity_name_unique IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE")
             session.run("CREATE CONSTRAINT event_unique IF NOT EXISTS FOR (e:Event) REQUIRE (e.event_type, e.book, e.chapter) IS UNIQUE")
             session.run("CREATE INDEX relation_type IF NOT EXISTS FOR ()-[r:RELATION]-() ON (r.type)")
+            session.run("CREATE INDEX event_book_chapter IF NOT EXISTS FOR (e:Event) ON (e.book, e.chapter)")
+
+    # 每批 UNWIND 行数：单条 session.run 每项一次往返，批量后降为 N/1000 次
+    BATCH_SIZE = 1000
+    # 每个显式事务累计的行数：session.run 每批一次隐式提交，
+    # 按 1 万行一个事务摊薄 commit/fsync，又不至于事务内存爆掉
+    TX_OPS = 10000
+
+    EVENT_CYPHER = (
+        "UNWIND $rows AS r "
+        "MERGE (e:Event {event_type:r.et, book:r.bk, chapter:r.cid}) "
+        "SET e.time=r.tm, e.location=r.loc, e.evidence=r.ev, e.confidence=r.conf, e.participants_json=r.parts"
+    )
+
+    @staticmethod
+    def _run_batched(session, cypher: str, rows: list):
+        for t in range(0, len(rows), Neo4jIngestor.TX_OPS):
+            chunk = rows[t:t + Neo4jIngestor.TX_OPS]
+
+            def work(tx, chunk=chunk):
+                for i in range(0, len(chunk), Neo4jIngestor.BATCH_SIZE):
+                    tx.run(cypher, rows=chunk[i:i + Neo4jIngestor.BATCH_SIZE])
+
+            session.execute_write(work)
 
     def neo4j_upsert(self, session, kg: Dict, book_key: str, chapter_id: str):
-        for ent in kg.get("entities", []):
-            session.run("MERGE (e:Entity {name:$name})", name=ent["name"]) 
+        # 先在 Python 侧去重，跨章重复实体不再各付一次 MERGE 索引查找
+        names = list({ent["name"] for ent in kg.get("entities", [])})
+        rel_rows = []
         for rel in kg.get("relations", []):
-            rt = rel.get("relation")
-            ql_json = json.dumps(rel.get("qualifiers") or {}, ensure_ascii=False)
-            session.run(
-                "MATCH (h:Entity {name:$h}) MATCH (t:Entity {name:$t}) "
-                "MERGE (h)-[r:RELATION {type:$rt, book:$bk, chapter:$cid}]->(t) "
-                "SET r.confidence=$conf, r.evidence=$ev, r.qualifiers_json=$ql_json",
-                h=rel["head"], t=rel["tail"],
-                rt=rt, bk=book_key, cid=(rel.get("chapter_id") or chapter_id),
-                conf=rel.get("confidence"), ev=rel.get("evidence"), ql_json=ql_json
-            )
-        for evt in kg.get("events", []):
-            parts_json = json.dumps(evt.get("participants") or {}, ensure_ascii=False)
-            session.run(
-                "MERGE (e:Event {event_type:$et, book:$bk, chapter:$cid}) "
-                "SET e.time=$tm, e.location=$loc, e.evidence=$ev, e.confidence=$conf, e.participants_json=$parts_json",
-                et=evt.get("event_type"), bk=book_key, cid=chapter_id,
-                tm=evt.get("time"), loc=evt.get("location"), ev=evt.get("evidence"),
-                conf=evt.get("confidence"), parts_json=parts_json
+            rel_rows.append({
+                "h": rel["head"], "t": rel["tail"],
+                "rt": rel.get("relation"), "bk": book_key,
+                "cid": (rel.get("chapter_id") or chapter_id),
+                "conf": rel.get("confidence"), "ev": rel.get("evidence"),
+                "ql": _dumps(rel.get("qualifiers") or {})
+            })
+        if names:
+            def ent_work(tx):
+                for i in range(0, len(names), self.BATCH_SIZE):
+                    tx.run("UNWIND $names AS n MERGE (:Entity {name:n})", names=names[i:i + self.BATCH_SIZE])
+
+            session.execute_write(ent_work)
+        if rel_rows:
+            self._run_batched(
+                session,
+                "UNWIND $rows AS r "
+                "MATCH (h:Entity {name:r.h}) MATCH (t:Entity {name:r.t}) "
+                "MERGE (h)-[x:RELATION {type:r.rt, book:r.bk, chapter:r.cid}]->(t) "
+                "SET x.confidence=r.conf, x.evidence=r.ev, x.qualifiers_json=r.ql",
+                rel_rows
             )
+        if kg.get("events"):
+            self.neo4j_upsert_events(session, kg["events"], book_key, chapter_id)
+
+    @staticmethod
+    def _event_rows(events: list, book_key: str, chapter_id: str) -> list:
+        return [{
+            "et": evt.get("event_type"), "bk": book_key, "cid": chapter_id,
+            "tm": evt.get("time"), "loc": evt.get("location"),
+            "ev": evt.get("evidence"), "conf": evt.get("confidence"),
+            "parts": _dumps(evt.get("participants") or {})
+        } for evt in events or []]
 
     def neo4j_upsert_events(self, session, events: list, book_key: str, chapter_id: str):
-        for evt in events or []:
-            parts_json = json.dumps(evt.get("participants") or {}, ensure_ascii=False)
-            session.run(
-                "MERGE (e:Event {event_type:$et, book:$bk, chapter:$cid}) "
-                "SET e.time=$tm, e.location=$loc, e.evidence=$ev, e.confidence=$conf, e.participants_json=$parts_json",
-                et=evt.get("event_type"), bk=book_key, cid=chapter_id,
-                tm=evt.get("time"), loc=evt.get("location"), ev=evt.get("evidence"),
-                conf=evt.get("confidence"), parts_json=parts_json
-            )
+        evt_rows = self._event_rows(events, book_key, chapter_id)
+        if evt_rows:
+            self._run_batched(session, self.EVENT_CYPHER, evt_rows)
 
-    def ingest_results(self):
-        books = list_target_books(self.settings)
+    def _collect_book(self, bk: str):
+        """读取一本书的全部结果文件，返回 (entities, fused_rel, events_list)
+
+        校准、融合、实体收集在同一条流里完成：关系从 normalize_output
+        出来后逐条过 iter_calibrated 再喂给 RelationFuser，不再攒
+        all_rel / cal_rel 两个全量中间列表。
+        """
         default_tpl = self.settings.get("prompts", {}).get("selected", "relations_plus")
-        for bk in books:
-            p = resolve_paths(self.settings, bk)
-            base = p["results_dir"]
-            names = [x for x in os.listdir(base) if x.endswith(".json")]
-            all_rel = []
-            events_list = []
-            for name in names:
-                fp = os.path.join(base, name)
-                with open(fp, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                meta = data.get("meta") or {}
-                tpl_id = meta.get("template_id") or default_tpl
-                tpl = next((t for t in self.settings.get("prompts", {}).get("templates", []) if t.get("id") == tpl_id), {})
-                syn = tpl.get("variables", {}).get("synonyms_map", {}) or {}
-                alias_rules = tpl.get("variables", {}).get("alias_rules", []) or []
-                alias_relations = self.settings.get("relations", {}).get("alias_relations", [])
-                kg = normalize_output(data, tpl_id, syn, alias_rules, alias_relations)
-                chapter_id = meta.get("chapter_id") or name.split("result_")[1].split(".json")[0].split("__")[0]
-                for r in kg.get("relations", []):
-                    nr = dict(r)
-                    nr["chapter_id"] = chapter_id
-                    all_rel.append(nr)
-                events_list.append((chapter_id, kg.get("events", [])))
-            cal_rel = calibrate_relations(all_rel, self.settings)
-            fused_rel = fuse_relations(cal_rel, self.settings)
-            entities = []
-            seen = set()
-            for r in fused_rel:
+        p = resolve_paths(self.settings, bk)
+        base = p["results_dir"]
+        fuser = RelationFuser(self.settings)
+        entities = []
+        seen = set()
+        events_list = []
+        # 模板查找做成 id 索引，别名关系配置取一次，不在每个文件里重扫列表；
+        # 同义词表与别名规则每个模板只解析一次，编译好的 AliasRules 直接传入
+        tpl_by_id = {t.get("id"): t for t in self.settings.get("prompts", {}).get("templates", [])}
+        alias_relations = self.settings.get("relations", {}).get("alias_relations", [])
+        alias_by_tpl = {
+            tid: (t.get("variables", {}).get("synonyms_map", {}) or {},
+                  parse_alias_rules(t.get("variables", {}).get("alias_rules", []) or []))
+            for tid, t in tpl_by_id.items()
+        }
+        empty_alias = parse_alias_rules([])
+
+        def _normalize_one(data, fallback_cid):
+            meta = data.get("meta") or {}
+            tpl_id = meta.get("template_id") or default_tpl
+            syn, alias = alias_by_tpl.get(tpl_id, ({}, empty_alias))
+            kg = normalize_output(data, tpl_id, syn, None, alias_relations, alias=alias)
+            return meta.get("chapter_id") or fallback_cid, kg
+
+        def _consume(chapter_id, kg):
+            stream = ({**r, "chapter_id": chapter_id} for r in kg.get("relations", []))
+            for r in iter_calibrated(stream, self.settings):
+                fuser.add(r)
                 h = r.get("head")
                 t = r.get("tail")
                 if h and h not in seen:
                     seen.add(h); entities.append({"name": h})
                 if t and t not in seen:
                     seen.add(t); entities.append({"name": t})
+            events_list.append((chapter_id, kg.get("events", [])))
+
+        if self.settings.get("results", {}).get("backend", "files") == "sqlite":
+            # sqlite 后端的结果在 results.db 里，扫目录只会得到空集；
+            # 逐条主键查询足够快，且进程级共享连接不宜并发读，串行即可
+            for cid, tpl, model in result_store.list_results(base):
+                data = result_store.load_result(base, cid, tpl, model)
+                if data is not None:
+                    _consume(*_normalize_one(data, cid))
+        else:
+            # scandir 的 DirEntry 自带类型信息，省去 listdir 后逐个 stat；
+            # 只认 result_*.json，结果目录里的缓存等杂项文件不进入库流程
+            with os.scandir(base) as it:
+                names = [e.name for e in it if e.is_file() and e.name.startswith("result_") and e.name.endswith(".json")]
+
+            def _load_one(name):
+                fp = os.path.join(base, name)
+                with open(fp, "rb") as f:
+                    data = _loads(f.read())
+                return _normalize_one(data, name.split("result_")[1].split(".json")[0].split("__")[0])
+
+            # 读盘+解析+归一化交给线程池重叠；pool.map 保持 names 顺序，
+            # 融合、实体去重仍在主线程串行，无需加锁
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                for chapter_id, kg in pool.map(_load_one, names):
+                    _consume(chapter_id, kg)
+        return entities, fuser.finish(), events_list
+
+    def ingest_results(self):
+        books = list_target_books(self.settings)
+        for bk in books:
+            entities, fused_rel, events_list = self._collect_book(bk)
             book_key = bk
             with self.driver.session() as session:
                 kg_rel = {"entities": entities, "relations": fused_rel, "events": []}
                 self.neo4j_upsert(session, kg_rel, book_key, "MULTI")
+                # 全书事件先攒成行再统一走批量事务，而不是每章一个事务
+                evt_rows = []
                 for chapter_id, evs in events_list:
-                    self.neo4j_upsert_events(session, evs, book_key, chapter_id)
+                    evt_rows.extend(self._event_rows(evs, book_key, chapter_id))
+                if evt_rows:
+                    self._run_batched(session, self.EVENT_CYPHER, evt_rows)
+
+    def export_csv(self, out_dir: str):
+        """导出 neo4j-admin database import 可用的 CSV，绕开 Bolt 逐条写入。
+
+        初次建库时用离线批量导入比在线 MERGE 快几个数量级；在线库也可
+        改用 LOAD CSV 消费同一批文件。
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        books = list_target_books(self.settings)
+        ent_by_name: Dict[str, dict] = {}
+        rel_rows = []
+        # 同章同类型事件共用一个 eventId；导入器不接受重复 ID，
+        # 按 ID 保留最后一行，对齐在线路径 MERGE + SET 的覆盖语义
+        evt_by_id: Dict[str, list] = {}
+        for bk in books:
+            entities, fused_rel, events_list = self._collect_book(bk)
+            for ent in entities:
+                ent_by_name.setdefault(ent["name"], ent)
+            for rel in fused_rel:
+                rel_rows.append([
+                    rel["head"], rel["tail"], "RELATION",
+                    rel.get("relation") or "", bk, rel.get("chapter_id") or "",
+                    rel.get("confidence") if rel.get("confidence") is not None else "",
+                    rel.get("evidence") or "",
+                    _dumps(rel.get("qualifiers") or {})
+                ])
+            for chapter_id, evs in events_list:
+                for evt in evs or []:
+                    event_id = f"{bk}:{chapter_id}:{evt.get('event_type') or ''}"
+                    evt_by_id[event_id] = [
+                        event_id,
+                        evt.get("event_type") or "", bk, chapter_id,
+                        evt.get("time") or "", evt.get("location") or "",
+                        evt.get("evidence") or "",
+                        evt.get("confidence") if evt.get("confidence") is not None else "",
+                        _dumps(evt.get("participants") or {})
+                    ]
+        paths = {
+            "entities": os.path.join(out_dir, "entities.csv"),
+            "relations": os.path.join(out_dir, "relations.csv"),
+            "events": os.path.join(out_dir, "events.csv"),
+        }
+        with open(paths["entities"], "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+            w.writerow(["name:ID(Entity)"])
+            w.writerows([name] for name in ent_by_name)
+        with open(paths["relations"], "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+            w.writerow([":START_ID(Entity)", ":END_ID(Entity)", ":TYPE", "type", "book", "chapter", "confidence:float", "evidence", "qualifiers_json"])
+            w.writerows(rel_rows)
+        with open(paths["events"], "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+            w.writerow(["eventId:ID(Event)", "event_type", "book", "chapter", "time", "location", "evidence", "confidence:float", "participants_json"])
+            w.writerows(evt_by_id.values())
+        return paths
 
     def close(self):
         self.driver.close()
@@ -116,11 +260,23 @@ def ingest_results():
 
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="结果入库 Neo4j，或导出批量导入 CSV")
+    parser.add_argument("--bulk-csv", metavar="OUT_DIR", default=None,
+                        help="不走 Bolt 写入，改为导出 entities/relations/events CSV 到指定目录")
+    args = parser.parse_args()
     settings = load_settings()
     ingestor = Neo4jIngestor(settings)
-    ingestor.ensure_constraints()
-    ingestor.ingest_results()
-    ingestor.close()
+    try:
+        if args.bulk_csv:
+            paths = ingestor.export_csv(args.bulk_csv)
+            print("CSV 已导出，离线导入命令（需停库执行）：")
+            print(f"  neo4j-admin database import full --nodes=Entity={paths['entities']} --nodes=Event={paths['events']} --relationships=RELATION={paths['relations']} neo4j")
+        else:
+            ingestor.ensure_constraints()
+            ingestor.ingest_results()
+    finally:
+        ingestor.close()
 
 
 if __name__ == "__main__":
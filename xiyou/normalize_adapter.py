@@ -1,9 +1,35 @@
 import re
+import functools
+from dataclasses import dataclass
 from typing import Any, Dict, List, Tuple
 
 TYPE_ENUM = {"Person","Location","Item","Spell","Organization","Deity"}
 
-def parse_alias_rules(rules: List[str]) -> Dict[str, List]:
+@dataclass(slots=True, frozen=True)
+class AliasRules:
+    """解析后的别名规则：属性访问替代每次 dict.get"""
+    strip_tokens: Tuple[str, ...] = ()
+    regex_rules: Tuple[Tuple[object, str], ...] = ()
+    # 全部规则合并成的单一交替式（替换串都是字面量时才可用）；
+    # replacements 按命名组名 g{i} 找对应替换串
+    combined: object = None
+    replacements: Dict[str, str] = None
+
+def _apply_regex(name: str, alias: AliasRules) -> str:
+    if alias.combined is not None:
+        reps = alias.replacements
+        return alias.combined.sub(
+            lambda m: next(reps[k] for k, v in m.groupdict().items() if v is not None), name)
+    for pat, rep in alias.regex_rules:
+        name = pat.sub(rep, name)
+    return name
+
+def parse_alias_rules(rules: List[str]) -> AliasRules:
+    # 同一模板的规则在每个结果文件上都一样，按规则元组缓存编译产物
+    return _parse_alias_rules_cached(tuple(map(str, rules or ())))
+
+@functools.lru_cache(maxsize=None)
+def _parse_alias_rules_cached(rules: Tuple[str, ...]) -> AliasRules:
     strip_tokens: List[str] = []
     regex_rules: List[Tuple[object, str]] = []
     for s in rules or []:
@@ -17,33 +43,36 @@ def parse_alias_rules(rules: List[str]) -> Dict[str, List]:
             if "=" in expr:
                 pat, rep = expr.split("=", 1)
                 try:
-                    regex_rules.append((re.compile(pat.strip()), rep))
-                except:
+                    # 编译期连替换串一起验证（坏的反向引用在 sub 时才报），
+                    # 这样热路径上的 sub 无需 try/except
+                    compiled = re.compile(pat.strip())
+                    compiled.sub(rep, "")
+                    regex_rules.append((compiled, rep))
+                except re.error:
                     pass
-    return {"strip_tokens": strip_tokens, "regex_rules": regex_rules}
-
-def canonical_original(name: str, alias: Dict[str, List]) -> str:
-    n = str(name or "").strip()
-    for pat, rep in alias.get("regex_rules", []):
+    combined = None
+    replacements = None
+    if regex_rules and all("\\" not in rep for _, rep in regex_rules):
+        # R 条规则 R 次扫描合并为一次；带反向引用的替换串无法合并（组号会偏移），
+        # 或组名冲突编译失败时，退回逐条 sub
         try:
-            n = pat.sub(rep, n)
-        except:
-            pass
+            combined = re.compile("|".join(f"(?P<g{i}>{pat.pattern})" for i, (pat, _) in enumerate(regex_rules)))
+            replacements = {f"g{i}": rep for i, (_, rep) in enumerate(regex_rules)}
+        except re.error:
+            combined = None
+            replacements = None
+    return AliasRules(strip_tokens=tuple(strip_tokens), regex_rules=tuple(regex_rules),
+                      combined=combined, replacements=replacements)
+
+def canonical_original(name: str, alias: AliasRules) -> str:
+    n = _apply_regex(str(name or "").strip(), alias)
     return n.strip()
 
-def canonical_norm(name: str, synonyms: Dict[str, str], alias: Dict[str, List]) -> str:
-    n = str(name or "").strip()
-    for pat, rep in alias.get("regex_rules", []):
-        try:
-            n = pat.sub(rep, n)
-        except:
-            pass
+def canonical_norm(name: str, synonyms: Dict[str, str], alias: AliasRules) -> str:
+    n = _apply_regex(str(name or "").strip(), alias)
     n = synonyms.get(n, n)
-    for tok in alias.get("strip_tokens", []):
-        if n.startswith(tok):
-            n = n[len(tok):]
-        if n.endswith(tok):
-            n = n[:-len(tok)]
+    for tok in alias.strip_tokens:
+        n = n.removeprefix(tok).removesuffix(tok)
     return n.strip()
 
 def _relations_from_obj(obj: Any) -> List[Dict]:
@@ -56,8 +85,9 @@ def _relations_from_obj(obj: Any) -> List[Dict]:
         return obj
     return []
 
-def normalize_relations(obj: Any, syn: Dict[str, str], alias: Dict[str, List], alias_relations: List[str]) -> List[Dict]:
+def normalize_relations(obj: Any, syn: Dict[str, str], alias: AliasRules, alias_relations: List[str]) -> List[Dict]:
     rels = _relations_from_obj(obj)
+    alias_rel_set = set(alias_relations or [])
     out: List[Dict] = []
     for r in rels or []:
         raw_head = r.get("head") or r.get("subject") or ""
@@ -66,7 +96,7 @@ def normalize_relations(obj: Any, syn: Dict[str, str], alias: Dict[str, List], a
         if not raw_head or not raw_tail or not raw_type:
             continue
         rt = str(raw_type)
-        if rt in set(alias_relations or []):
+        if rt in alias_rel_set:
             ah = canonical_original(raw_head, alias)
             at = canonical_original(raw_tail, alias)
             alias_side = None
@@ -105,7 +135,7 @@ def normalize_relations(obj: Any, syn: Dict[str, str], alias: Dict[str, List], a
         out.append(item)
     return out
 
-def normalize_events(obj: Any, syn: Dict[str, str], alias: Dict[str, List]) -> List[Dict]:
+def normalize_events(obj: Any, syn: Dict[str, str], alias: AliasRules) -> List[Dict]:
     evs = []
     if isinstance(obj, dict):
         evs = obj.get("events") or obj.get("event_plus_relation") or []
@@ -131,7 +161,7 @@ def normalize_events(obj: Any, syn: Dict[str, str], alias: Dict[str, List]) -> L
         out.append({"event_type": et, "time": tm, "location": loc, "participants": parts, "evidence": e.get("evidence"), "confidence": e.get("confidence")})
     return out
 
-def collect_entities(relations: List[Dict], entities_hint: List[Dict], syn: Dict[str, str], alias: Dict[str, List]) -> List[Dict]:
+def collect_entities(relations: List[Dict], entities_hint: List[Dict], syn: Dict[str, str], alias: AliasRules) -> List[Dict]:
     seen = set()
     out: List[Dict] = []
     for r in relations or []:
@@ -147,8 +177,9 @@ def collect_entities(relations: List[Dict], entities_hint: List[Dict], syn: Dict
             seen.add(n); out.append({"name": n})
     return out
 
-def normalize_output(raw: Any, tpl_id: str, synonyms_map: Dict[str, str], alias_rules: List[str], alias_relations: List[str] = None) -> Dict:
-    alias = parse_alias_rules(alias_rules or [])
+def normalize_output(raw: Any, tpl_id: str, synonyms_map: Dict[str, str], alias_rules: List[str], alias_relations: List[str] = None, alias: AliasRules = None) -> Dict:
+    if alias is None:
+        alias = parse_alias_rules(alias_rules or [])
     relations = normalize_relations(raw, synonyms_map or {}, alias, alias_relations or [])
     entities_hint = raw.get("entities") if isinstance(raw, dict) else []
     events = normalize_events(raw, synonyms_map or {}, alias)
@@ -160,79 +191,110 @@ def normalize_output(raw: Any, tpl_id: str, synonyms_map: Dict[str, str], alias_
     relations = relations + extra_alias
     return {"entities": entities, "relations": relations, "events": events, "meta": meta}
 
-def calibrate_relations(relations: List[Dict], settings: Dict) -> List[Dict]:
+def iter_calibrated(relations, settings: Dict):
+    """逐条校准关系的生成器：供流式入库使用，不落中间列表"""
     cfg = settings.get("relations", {})
     patterns = cfg.get("patterns", [])
     allowed = set(cfg.get("allowed", []))
-    out: List[Dict] = []
+    # 每个 pattern 的关键词预编译成一条交替式：逐词 in 的 Python 循环
+    # 变成每条证据一次 C 级扫描（re.compile 自带模块级缓存，跨调用复用）
+    compiled = []
+    for p in patterns:
+        inc = p.get("include") or []
+        exc = p.get("exclude") or []
+        inc_re = re.compile("|".join(map(re.escape, inc))) if inc else None
+        exc_re = re.compile("|".join(map(re.escape, exc))) if exc else None
+        compiled.append((p.get("relation"), inc_re, exc_re))
     for r in relations or []:
         ev = str(r.get("evidence") or "")
         added = False
-        for p in patterns:
-            rel = p.get("relation")
-            inc = p.get("include") or []
-            exc = p.get("exclude") or []
-            if inc and any(k in ev for k in inc) and not any(x in ev for x in exc):
+        for rel, inc_re, exc_re in compiled:
+            if inc_re is not None and inc_re.search(ev) and not (exc_re is not None and exc_re.search(ev)):
                 nr = dict(r)
                 nr["relation"] = rel
-                out.append(nr)
                 added = True
-        if not added:
-            out.append(r)
-    if allowed:
-        out = [x for x in out if str(x.get("relation")) in allowed or not allowed]
-    return out
+                if not allowed or str(rel) in allowed:
+                    yield nr
+        if not added and (not allowed or str(r.get("relation")) in allowed):
+            yield r
 
-def fuse_relations(relations: List[Dict], settings: Dict) -> List[Dict]:
-    fusion = settings.get("fusion", {})
-    group_by = fusion.get("group_by", "head_tail")
-    evidence_merge = fusion.get("evidence_merge", "union")
-    confidence_merge = fusion.get("confidence_merge", "max")
-    chapter_strategy = fusion.get("chapter_strategy", "first")
-    precedence = settings.get("relations", {}).get("precedence", [])
-
-    groups: Dict[str, List[Dict]] = {}
-    for r in relations or []:
-        if group_by == "head_tail":
-            k = f"{r.get('head')}|{r.get('tail')}"
+def calibrate_relations(relations: List[Dict], settings: Dict) -> List[Dict]:
+    return list(iter_calibrated(relations, settings))
+
+class RelationFuser:
+    """流式关系融合：add() 逐条累积组内统计，finish() 一次性产出。
+
+    相比先攒全量关系列表再分组，内存从 O(关系数) 降到 O(组数)，
+    入库侧可边读结果文件边喂给 add()。
+    """
+
+    def __init__(self, settings: Dict):
+        fusion = settings.get("fusion", {})
+        self.group_by = fusion.get("group_by", "head_tail")
+        self.key_fmt = fusion.get("key_format", "{head}|{tail}|{relation}")
+        self.evidence_merge = fusion.get("evidence_merge", "union")
+        self.confidence_merge = fusion.get("confidence_merge", "max")
+        self.chapter_strategy = fusion.get("chapter_strategy", "first")
+        precedence = settings.get("relations", {}).get("precedence", [])
+        # precedence.index 是 O(P)，换成一次性构建的下标表
+        self.precedence_index = {rel: i for i, rel in enumerate(precedence)}
+        self.default_pri = len(precedence)
+        self.groups: Dict[Tuple, Dict] = {}
+
+    def _rank(self, r: Dict) -> tuple:
+        return (self.precedence_index.get(r.get("relation"), self.default_pri), -(r.get("confidence") or 0.0))
+
+    def add(self, r: Dict):
+        # 元组直接可哈希，省掉每条关系一次 f-string 拼接，
+        # 且名字里含分隔符时不会串键
+        if self.group_by == "head_tail":
+            k = (r.get("head"), r.get("tail"))
+        else:
+            k = self.key_fmt.format(head=r.get("head"), tail=r.get("tail"), relation=r.get("relation"))
+        conf = r.get("confidence") or 0.0
+        acc = self.groups.get(k)
+        if acc is None:
+            acc = self.groups[k] = {
+                "winner": r, "rank": self._rank(r),
+                "ev_set": set(), "conf_max": conf, "conf_sum": conf, "n": 1,
+                "chapters": [],
+            }
         else:
-            key_fmt = fusion.get("key_format", "{head}|{tail}|{relation}")
-            k = key_fmt.format(head=r.get("head"), tail=r.get("tail"), relation=r.get("relation"))
-        groups.setdefault(k, []).append(r)
+            rank = self._rank(r)
+            # 严格小于：并列时保留先到者，与 min() 语义一致
+            if rank < acc["rank"]:
+                acc["winner"] = r
+                acc["rank"] = rank
+            if conf > acc["conf_max"]:
+                acc["conf_max"] = conf
+            acc["conf_sum"] += conf
+            acc["n"] += 1
+        ev = r.get("evidence")
+        if self.evidence_merge == "union" and isinstance(ev, str):
+            acc["ev_set"].add(ev)
+        cid = r.get("chapter_id")
+        if cid:
+            acc["chapters"].append(cid)
 
-    out: List[Dict] = []
-    for k, items in groups.items():
-        # 选择唯一关系：按 precedence 优先级，其次按 confidence 最大
-        def rel_rank(x: Dict) -> tuple:
-            rel = x.get("relation")
-            pri = precedence.index(rel) if rel in precedence else len(precedence)
-            conf = x.get("confidence") or 0.0
-            return (pri, -conf)
-        winner = sorted(items, key=rel_rank)[0]
-        head = winner.get("head")
-        tail = winner.get("tail")
-        relation = winner.get("relation")
-        # 合并证据
-        ev_set = set()
-        for it in items:
-            ev = it.get("evidence")
-            if evidence_merge == "union" and isinstance(ev, str):
-                ev_set.add(ev)
-        evidence = " | ".join(sorted(ev_set))
-        # 合并置信度
-        confidences = [it.get("confidence") or 0.0 for it in items]
-        confidence = max(confidences) if confidence_merge == "max" else (sum(confidences)/len(confidences) if confidences else 0.0)
-        # 合并章节
-        chapters = [it.get("chapter_id") for it in items if it.get("chapter_id")]
-        chapter_id = chapters[0] if (chapter_strategy == "first" and chapters) else None
-        # 结果
-        out.append({
-            "head": head,
-            "tail": tail,
-            "relation": relation,
-            "confidence": confidence,
-            "evidence": evidence,
-            "qualifiers": {"chapters": chapters},
-            "chapter_id": chapter_id,
-        })
-    return out
+    def finish(self) -> List[Dict]:
+        out: List[Dict] = []
+        for acc in self.groups.values():
+            winner = acc["winner"]
+            confidence = acc["conf_max"] if self.confidence_merge == "max" else acc["conf_sum"] / acc["n"]
+            chapters = acc["chapters"]
+            out.append({
+                "head": winner.get("head"),
+                "tail": winner.get("tail"),
+                "relation": winner.get("relation"),
+                "confidence": confidence,
+                "evidence": " | ".join(sorted(acc["ev_set"])),
+                "qualifiers": {"chapters": chapters},
+                "chapter_id": chapters[0] if (self.chapter_strategy == "first" and chapters) else None,
+            })
+        return out
+
+def fuse_relations(relations: List[Dict], settings: Dict) -> List[Dict]:
+    fuser = RelationFuser(settings)
+    for r in relations or []:
+        fuser.add(r)
+    return fuser.finish()
@@ -0,0 +1,86 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 每本书一个 SQLite 库（results_dir/results.db），替代成百上千个
+# result_*.json 小文件：批量比较从上千次 open+parse 变成一条索引查询。
+# payload 用 msgpack 存储（缺依赖时退回 JSON 字节），两种格式读取时自动识别。
+
+_connections: Dict[str, sqlite3.Connection] = {}
+_lock = threading.Lock()
+
+def _db_path(results_dir: str) -> str:
+    return os.path.join(results_dir, "results.db")
+
+def get_connection(results_dir: str) -> sqlite3.Connection:
+    path = _db_path(results_dir)
+    with _lock:
+        con = _connections.get(path)
+        if con is None:
+            os.makedirs(results_dir, exist_ok=True)
+            con = sqlite3.connect(path, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "cid TEXT NOT NULL, tpl TEXT NOT NULL, model TEXT NOT NULL DEFAULT '', "
+                "payload BLOB NOT NULL, ts TEXT, "
+                "PRIMARY KEY (cid, tpl, model))"
+            )
+            _connections[path] = con
+    return con
+
+def _pack(payload: dict) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def _unpack(blob: bytes):
+    # JSON 以 { / [ 开头；其余按 msgpack 解
+    if blob[:1] in (b"{", b"["):
+        return json.loads(blob.decode("utf-8"))
+    if msgpack is None:
+        return None
+    return msgpack.unpackb(blob, raw=False)
+
+def save_result(results_dir: str, cid: str, tpl_id: str, model: str, payload: dict, ts: str):
+    con = get_connection(results_dir)
+    with _lock:
+        con.execute(
+            "INSERT OR REPLACE INTO results(cid, tpl, model, payload, ts) VALUES(?,?,?,?,?)",
+            (cid, tpl_id, model or "", _pack(payload), ts)
+        )
+        con.commit()
+
+def has_result(results_dir: str, cid: str, tpl_id: str, model: Optional[str] = None) -> bool:
+    con = get_connection(results_dir)
+    if model:
+        row = con.execute("SELECT 1 FROM results WHERE cid=? AND tpl=? AND model=? LIMIT 1", (cid, tpl_id, model)).fetchone()
+    else:
+        row = con.execute("SELECT 1 FROM results WHERE cid=? AND tpl=? LIMIT 1", (cid, tpl_id)).fetchone()
+    return row is not None
+
+def load_result(results_dir: str, cid: str, tpl_id: str, model: Optional[str] = None):
+    con = get_connection(results_dir)
+    if model:
+        row = con.execute("SELECT payload FROM results WHERE cid=? AND tpl=? AND model=? LIMIT 1", (cid, tpl_id, model)).fetchone()
+    else:
+        row = con.execute("SELECT payload FROM results WHERE cid=? AND tpl=? ORDER BY ts DESC LIMIT 1", (cid, tpl_id)).fetchone()
+    if row is None:
+        return None
+    try:
+        return _unpack(row[0])
+    except Exception:
+        return None
+
+def list_results(results_dir: str) -> List[Tuple[str, str, str]]:
+    """返回全部 (cid, tpl, model) 行，供 overview 汇总"""
+    if not os.path.exists(_db_path(results_dir)):
+        return []
+    con = get_connection(results_dir)
+    return con.execute("SELECT cid, tpl, model FROM results ORDER BY cid").fetchall()
@@ -1,6 +1,8 @@
 import re
 import os
+import mmap
 import shutil
+from pathlib import Path
 import json
 import time
 import logging
@@ -22,6 +24,8 @@ FILENAME_MODE = settings["naming"]["mode"]
 
 # 正则表达式：匹配章节标题 (与V2版相同，已优化)
 CHAPTER_PATTERN = re.compile(r"^\s*第[零一二三四五六七八九十百千]+回.*")
+# 全文多行扫描版：mmap 路径上一次 finditer 定位所有章节标题
+CHAPTER_PATTERN_ML = re.compile(r"(?m)^[ \t]*第[零一二三四五六七八九十百千]+回[^\n]*$")
 # 结束标记：看到这一行就停止处理（Gutenberg 的标准结尾）
 END_MARKER = "*** END OF THE PROJECT GUTENBERG"
 
@@ -77,8 +81,8 @@ class ChapterSplitter:
         content = "\n".join(self.current_buffer).strip()
 
         if len(content) > 50:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            # 编码后一次 write_bytes 落盘，省掉文本包装层的缓冲拷贝
+            Path(file_path).write_bytes(content.encode("utf-8"))
 
             self.chapters.append(self.current_title)
             logging.info(json.dumps({"stage": "split", "event": "save", "file": filename, "length": len(content)}, ensure_ascii=False))
@@ -87,9 +91,8 @@ class ChapterSplitter:
 
     def run(self):
         start = time.time()
-        # 1. 准备目录 (如果目录不存在，则创建)
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        # 1. 准备目录 (exist_ok 免去一次 exists 探测)
+        os.makedirs(self.output_dir, exist_ok=True)
 
         # 2. 【核心优化：安全清理旧文件】
         logging.info(json.dumps({"stage": "split", "event": "cleanup_start", "dir": self.output_dir}, ensure_ascii=False))
@@ -109,35 +112,70 @@ class ChapterSplitter:
         logging.info(json.dumps({"stage": "split", "event": "start", "input": self.input_path, "mode": FILENAME_MODE}, ensure_ascii=False))
 
         try:
-            with open(self.input_path, 'r', encoding='utf-8') as f:
-                started = False
-
-                for line in f:
-                    line = line.rstrip()
-
-                    if END_MARKER in line:
-                        break
-
-                    if CHAPTER_PATTERN.match(line) and len(line) < 50:
-                        if started:
-                            self._save_chapter()
-
-                        started = True
-                        self.current_title = line.strip()
-                        self.current_buffer = [self.current_title]
-                        continue
+            try:
+                self._run_mmap()
+            except (ValueError, OSError):
+                # 空文件等 mmap 不了的情况，退回逐行扫描
+                self._run_stream()
+        except FileNotFoundError:
+            logging.error(json.dumps({"stage": "split", "event": "error", "error_type": "FileNotFound", "input": self.input_path}, ensure_ascii=False))
+            return
+        duration = int((time.time() - start) * 1000)
+        logging.info(json.dumps({"stage": "split", "event": "done", "chapters": len(self.chapters), "duration_ms": duration}, ensure_ascii=False))
 
+    def _run_mmap(self):
+        """mmap 整个原文，一次 finditer 定位全部章节标题。
+
+        逐行 Python 循环 + 每行 match 换成两次 C 级扫描（find 结束标记、
+        finditer 标题），章节正文直接按相邻标题位置切片。
+        """
+        with open(self.input_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = mm.find(END_MARKER.encode("utf-8"))
+                raw = mm[:end] if end != -1 else mm[:]
+        # 标题字符类是多字节汉字，bytes 正则表达不了，解码一次后在 str 上扫
+        text = raw.decode("utf-8", errors="ignore")
+        matches = [m for m in CHAPTER_PATTERN_ML.finditer(text) if len(m.group().rstrip()) < 50]
+        for i, m in enumerate(matches):
+            stop = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            chunk = text[m.start():stop]
+            lines = [ln.rstrip() for ln in chunk.splitlines()]
+            self.current_title = lines[0].strip()
+            lines[0] = self.current_title
+            self.current_buffer = lines
+            self._save_chapter()
+
+    def _run_stream(self):
+        with open(self.input_path, 'r', encoding='utf-8') as f:
+            started = False
+
+            for line in f:
+                line = line.rstrip()
+
+                if END_MARKER in line:
+                    break
+
+                # 绝大多数行不是标题，先做廉价预筛挡掉再进正则引擎；
+                # 按首个非空白字符判断，全角空格缩进多深都不影响
+                if not line.lstrip().startswith("第"):
                     if started:
                         self.current_buffer.append(line)
+                    continue
+
+                if CHAPTER_PATTERN.match(line) and len(line) < 50:
+                    if started:
+                        self._save_chapter()
+
+                    started = True
+                    self.current_title = line.strip()
+                    self.current_buffer = [self.current_title]
+                    continue
 
                 if started:
-                    self._save_chapter()
+                    self.current_buffer.append(line)
 
-        except FileNotFoundError:
-            logging.error(json.dumps({"stage": "split", "event": "error", "error_type": "FileNotFound", "input": self.input_path}, ensure_ascii=False))
-            return
-        duration = int((time.time() - start) * 1000)
-        logging.info(json.dumps({"stage": "split", "event": "done", "chapters": len(self.chapters), "duration_ms": duration}, ensure_ascii=False))
+            if started:
+                self._save_chapter()
 
 
 # ================= 执行入口 =================